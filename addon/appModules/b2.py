@@ -4,21 +4,23 @@
 # Copyright (C) 2019-2022 Łukasz Golonka <lukasz.golonka@mailbox.org>
 # Released under GPL 2
 
-from ctypes import sizeof, byref, create_string_buffer
+import bisect
+import collections
+import functools
+from ctypes import sizeof, byref, create_string_buffer, Structure, c_int, c_uint32
 import locale
+import math
 import operator
 import re
-
-import six
+import threading
+import time
 
 import api
 import appModuleHandler
 from colors import RGB
 import controlTypes
-from displayModel import DisplayModelTextInfo, EditableTextDisplayModelTextInfo
-import locationHelper
+from displayModel import DisplayModelTextInfo, EditableTextDisplayModelTextInfo, getCaretRect
 from logHandler import log
-import mouseHandler
 import oleacc
 from NVDAObjects.behaviors import EditableTextWithoutAutoSelectDetection
 import NVDAObjects.IAccessible
@@ -28,20 +30,1313 @@ from NVDAObjects.IAccessible.sysTreeView32 import TreeViewItem
 from NVDAObjects.window import Window, DisplayModelEditableText
 from scriptHandler import script
 import textInfos
+from textInfos.offsets import Offsets
 import ui
 import watchdog
-import windowUtils
 import winUser
 import winKernel
 
 
+try:
+	STRING_TYPES = (basestring,)  # NOQA: F821 Python 2
+except NameError:
+	STRING_TYPES = (str,)  # Python 3
+
+try:
+	import queue  # Python 3
+except ImportError:
+	import Queue as queue  # NOQA: F401 Python 2
+
+try:
+	timer = time.perf_counter
+except AttributeError:
+	timer = time.clock  # Python 2
+
+
 # Constants:
 
+LVM_GETITEMCOUNT = 4100
+LVM_ENSUREVISIBLE = 4115
+LVM_SETITEMSTATE = 4139
 LVM_GETITEMTEXTA = 4141
+LVIS_FOCUSED = 0x1
+LVIS_SELECTED = 0x2
+TVM_GETNEXTITEM = 4362
+TVM_SELECTITEM = 4363
+TVM_MAPACCIDTOHTREEITEM = 4394
+TVM_GETITEMW = 4414
+TVGN_ROOT = 0x0
+TVGN_NEXT = 0x1
+TVGN_PARENT = 0x3
+TVGN_CHILD = 0x4
+TVGN_FIRSTVISIBLE = 0x5
+TVGN_CARET = 0x9
+TVIF_TEXT = 0x1
+TVIF_HANDLE = 0x10
+
+# Control IDs of list views containing messages.
+MESSAGE_LIST_CONTROL_IDS = (59648, 59649, 59664)
+
+# Seconds after which unread info read from the folder tree is considered outdated.
+# Becky! draws amount of unread messages itself, so it can change without any event being fired.
+FOLDER_TREE_SNAPSHOT_MAX_AGE = 2.0
+
+# Amount of rows above and below the focused message which are read in the background.
+ROWS_TO_PREFETCH = 5
+
+# Seconds the main thread waits for a message fetched in the background
+# before a placeholder is announced instead of its content.
+COLUMN_FETCH_TIMEOUT = 0.1
+PENDING_COLUMN_PLACEHOLDER = "Loading"
+
+# Seconds without update events after which a burst of them,
+# for example caused by fetching many messages, is considered finished.
+UPDATE_BURST_DELAY = 0.3
+
+# Seconds after which content of Becky!'s editor and message viewer is read from the display model again
+# even if no change has been noticed, as the window can be scrolled with the mouse without moving the caret.
+STORY_FIELDS_MAX_AGE = 1.0
 
 BECKY_SCRIPT_CATEGORY = "Becky"
 
 
+class lazyClassAttribute(object):
+	"""Computes value of a class attribute when it is accessed for the first time,
+	and replaces itself with the result.
+	"""
+
+	def __init__(self, func):
+		super(lazyClassAttribute, self).__init__()
+		self.func = func
+		self.__name__ = func.__name__
+		self.__doc__ = func.__doc__
+
+	def __get__(self, instance, owner):
+		value = self.func()
+		setattr(owner, self.__name__, value)
+		return value
+
+
+class TVITEMW(Structure):
+	"""Tree view item as laid out in Becky!'s memory - Becky! is a 32-bit application."""
+
+	_fields_ = [
+		("mask", c_uint32),
+		("hItem", c_uint32),
+		("state", c_uint32),
+		("stateMask", c_uint32),
+		("pszText", c_uint32),
+		("cchTextMax", c_int),
+		("iImage", c_int),
+		("iSelectedImage", c_int),
+		("cChildren", c_int),
+		("lParam", c_uint32),
+	]
+
+
+class RemoteBufferPool(object):
+	"""Memory regions in the address space of Becky! reused for all list view text queries.
+
+	Allocating and freeing remote memory for every column costs several cross-process calls,
+	so regions are kept after use, up to `MAX_FREE_REGIONS` of them, and released when the app module terminates.
+	Every query uses a region of its own, taken from the pool only for its duration,
+	so that the lock is held just while the list of free regions is changed, never while waiting for Becky!.
+	Queries made by the main thread are therefore not blocked when worker threads wait for Becky! which hangs.
+	Kernel functions and the message sender can be substituted, so that the pool can be exercised without Becky!.
+	"""
+
+	TEXT_SLOT_SIZE = CBEMAXSTRLEN * 2
+	# Enough for the main thread, the row prefetcher and workers of the column fetcher.
+	MAX_FREE_REGIONS = 4
+
+	def __init__(self, processHandle, kernel=None, sendMessage=None):
+		super(RemoteBufferPool, self).__init__()
+		self.processHandle = processHandle
+		self._kernel = kernel or winKernel
+		self._sendMessage = sendMessage or watchdog.cancellableSendMessage
+		self._lock = threading.Lock()
+		# `(address, size)` of regions not used at the moment, the smallest first.
+		self._freeRegions = []
+		self._isReleased = False
+
+	def _acquireRegion(self, size):
+		"""Returns `(address, size)` of a remote region of at least the given size, used only by the caller."""
+		with self._lock:
+			for regionIndex, (address, regionSize) in enumerate(self._freeRegions):
+				if regionSize >= size:
+					return self._freeRegions.pop(regionIndex)
+		address = self._kernel.virtualAllocEx(
+			self.processHandle,
+			None,
+			size,
+			self._kernel.MEM_COMMIT,
+			self._kernel.PAGE_READWRITE
+		)
+		return address, size
+
+	def _releaseRegion(self, region):
+		"""Returns region to the pool, freeing the smallest one if too many are kept, or all after `release`."""
+		with self._lock:
+			if not self._isReleased:
+				self._freeRegions.append(region)
+				self._freeRegions.sort(key=lambda freeRegion: freeRegion[1])
+				if len(self._freeRegions) <= self.MAX_FREE_REGIONS:
+					return
+				region = self._freeRegions.pop(0)
+		self._kernel.virtualFreeEx(self.processHandle, region[0], 0, self._kernel.MEM_RELEASE)
+
+	def release(self):
+		"""Frees all regions. Regions used by queries in progress are freed once these queries end."""
+		with self._lock:
+			self._isReleased = True
+			freeRegions = self._freeRegions
+			self._freeRegions = []
+		for address, size in freeRegions:
+			self._kernel.virtualFreeEx(self.processHandle, address, 0, self._kernel.MEM_RELEASE)
+
+	def getItemTexts(self, windowHandle, LVITEM, itemIndex, subItems):
+		"""Retrieves text of the given sub-items of a list view item as raw bytes.
+
+		Returns a dictionary mapping sub-item index to its content, or `None` if it is empty.
+		"""
+		texts = self.getItemsTexts(windowHandle, LVITEM, [(itemIndex, subItem) for subItem in subItems])
+		return dict((subItem, text) for (itemIndex, subItem), text in texts.items())
+
+	def getItemsTexts(self, windowHandle, LVITEM, requests):
+		"""Retrieves text of the given `(item, sub-item)` pairs of a list view as raw bytes.
+
+		Structures for all requests are written to the remote region at once,
+		and after sending `LVM_GETITEMTEXTA` for each of them the whole region is read back in one go.
+		Returns a dictionary mapping each pair to its content, or `None` if it is empty.
+		"""
+		requests = tuple(requests)
+		if not requests:
+			return {}
+		itemSize = sizeof(LVITEM)
+		textStart = itemSize * len(requests)
+		regionSize = textStart + self.TEXT_SLOT_SIZE * len(requests)
+		region = self._acquireRegion(regionSize)
+		address = region[0]
+		try:
+			items = (LVITEM * len(requests))()
+			for slot, (itemIndex, subItem) in enumerate(requests):
+				items[slot] = LVITEM(
+					iItem=itemIndex,
+					mask=LVIF_TEXT | LVIF_COLUMNS,
+					iSubItem=subItem,
+					pszText=address + textStart + slot * self.TEXT_SLOT_SIZE,
+					cchTextMax=CBEMAXSTRLEN
+				)
+			self._kernel.writeProcessMemory(self.processHandle, address, byref(items), sizeof(items), None)
+			lengths = [
+				self._sendMessage(windowHandle, LVM_GETITEMTEXTA, itemIndex, address + slot * itemSize)
+				for slot, (itemIndex, subItem) in enumerate(requests)
+			]
+			if any(lengths):
+				localRegion = create_string_buffer(regionSize)
+				self._kernel.readProcessMemory(self.processHandle, address, localRegion, regionSize, None)
+			result = {}
+			for slot, (request, length) in enumerate(zip(requests, lengths)):
+				if not length:
+					result[request] = None
+					continue
+				item = LVITEM.from_buffer_copy(localRegion, slot * itemSize)
+				textOffset = textStart + slot * self.TEXT_SLOT_SIZE
+				if item.pszText == address + textOffset:
+					result[request] = localRegion.raw[textOffset:textOffset + length]
+				else:
+					# The control placed the text somewhere else - read it from there.
+					buffer = create_string_buffer(length)
+					self._kernel.readProcessMemory(self.processHandle, item.pszText, buffer, sizeof(buffer), None)
+					result[request] = buffer.raw[:length]
+		finally:
+			self._releaseRegion(region)
+		if sessionRecorder.isRecording:
+			sessionRecorder.recordListCells(windowHandle, result)
+		return result
+
+	def getTreeItemsTexts(self, windowHandle, itemHandles):
+		"""Retrieves text of the given tree view items, using one write and one read of the remote region.
+
+		Returns a dictionary mapping handle of each item to its text.
+		"""
+		itemHandles = tuple(itemHandles)
+		if not itemHandles:
+			return {}
+		itemSize = sizeof(TVITEMW)
+		textStart = itemSize * len(itemHandles)
+		regionSize = textStart + self.TEXT_SLOT_SIZE * len(itemHandles)
+		region = self._acquireRegion(regionSize)
+		address = region[0]
+		try:
+			items = (TVITEMW * len(itemHandles))()
+			for slot, itemHandle in enumerate(itemHandles):
+				items[slot] = TVITEMW(
+					mask=TVIF_TEXT | TVIF_HANDLE,
+					hItem=itemHandle,
+					pszText=address + textStart + slot * self.TEXT_SLOT_SIZE,
+					cchTextMax=self.TEXT_SLOT_SIZE // 2
+				)
+			self._kernel.writeProcessMemory(self.processHandle, address, byref(items), sizeof(items), None)
+			for slot, itemHandle in enumerate(itemHandles):
+				self._sendMessage(windowHandle, TVM_GETITEMW, 0, address + slot * itemSize)
+			localRegion = create_string_buffer(regionSize)
+			self._kernel.readProcessMemory(self.processHandle, address, localRegion, regionSize, None)
+			result = {}
+			for slot, itemHandle in enumerate(itemHandles):
+				item = TVITEMW.from_buffer_copy(localRegion, slot * itemSize)
+				textOffset = textStart + slot * self.TEXT_SLOT_SIZE
+				if item.pszText == address + textOffset:
+					data = localRegion.raw[textOffset:textOffset + self.TEXT_SLOT_SIZE]
+				else:
+					# The control placed the text somewhere else - read it from there.
+					buffer = create_string_buffer(self.TEXT_SLOT_SIZE)
+					self._kernel.readProcessMemory(self.processHandle, item.pszText, buffer, sizeof(buffer), None)
+					data = buffer.raw
+				result[itemHandle] = data.decode("utf_16_le", "replace").split(u"\0", 1)[0]
+		finally:
+			self._releaseRegion(region)
+		return result
+
+	def setItemState(self, windowHandle, LVITEM, itemIndex, state, stateMask):
+		"""Changes state of a list view item, or of all items if `itemIndex` is -1."""
+		region = self._acquireRegion(sizeof(LVITEM))
+		address = region[0]
+		try:
+			item = LVITEM(state=state, stateMask=stateMask)
+			self._kernel.writeProcessMemory(self.processHandle, address, byref(item), sizeof(LVITEM), None)
+			self._sendMessage(windowHandle, LVM_SETITEMSTATE, itemIndex, address)
+		finally:
+			self._releaseRegion(region)
+
+
+class LRUCache(object):
+	"""Thread safe mapping keeping at most `maxSize` most recently used entries.
+
+	Hits and misses are counted, so that the size can be tuned.
+	"""
+
+	def __init__(self, maxSize):
+		super(LRUCache, self).__init__()
+		self.maxSize = maxSize
+		self.hits = 0
+		self.misses = 0
+		self._entries = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def _trim(self):
+		while len(self._entries) > self.maxSize:
+			self._entries.popitem(last=False)
+
+	def get(self, key, default=None):
+		with self._lock:
+			try:
+				value = self._entries.pop(key)
+			except KeyError:
+				self.misses += 1
+				return default
+			self._entries[key] = value
+			self.hits += 1
+			return value
+
+	def put(self, key, value):
+		with self._lock:
+			self._entries.pop(key, None)
+			self._entries[key] = value
+			self._trim()
+
+	def resize(self, maxSize):
+		with self._lock:
+			self.maxSize = maxSize
+			self._trim()
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def pop(self, key, default=None):
+		with self._lock:
+			return self._entries.pop(key, default)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def resetStats(self):
+		with self._lock:
+			self.hits = 0
+			self.misses = 0
+
+
+class TimingStatistics(object):
+	"""Amount of calls and latencies of the add-on's hot paths.
+
+	Latencies of the most recent calls are kept in a fixed-size ring buffer per path.
+	Timing is disabled by default, timed functions only check the `enabled` flag in that case.
+	"""
+
+	def __init__(self, samplesPerPath=512):
+		super(TimingStatistics, self).__init__()
+		self.enabled = False
+		self.samplesPerPath = samplesPerPath
+		self._paths = collections.OrderedDict()
+
+	def record(self, path, seconds):
+		try:
+			samples, counters = self._paths[path]
+		except KeyError:
+			samples, counters = self._paths[path] = ([0.0] * self.samplesPerPath, [0])
+		callsCount = counters[0]
+		samples[callsCount % self.samplesPerPath] = seconds
+		counters[0] = callsCount + 1
+
+	def summary(self):
+		"""Returns tuples of path name, amount of calls, median, 90th and 99th percentile and maximum latency
+		computed from the recorded samples.
+		"""
+		result = []
+		for path, (samples, counters) in self._paths.items():
+			callsCount = counters[0]
+			recorded = sorted(samples[:min(callsCount, self.samplesPerPath)])
+			result.append((
+				path,
+				callsCount,
+				percentile(recorded, 50),
+				percentile(recorded, 90),
+				percentile(recorded, 99),
+				recorded[-1]
+			))
+		return result
+
+	def clear(self):
+		self._paths.clear()
+
+
+def percentile(sortedSamples, percent):
+	"""Nearest-rank percentile of the given, already sorted, samples."""
+	rank = max(int(round(percent / 100.0 * len(sortedSamples))), 1)
+	return sortedSamples[rank - 1]
+
+
+timingStatistics = TimingStatistics()
+
+
+def timed(path):
+	"""Records latencies of the decorated function in `timingStatistics` as `path` when timing is enabled."""
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not timingStatistics.enabled:
+				return func(*args, **kwargs)
+			start = timer()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				timingStatistics.record(path, timer() - start)
+		return wrapper
+	return decorator
+
+
+class SessionRecorder(object):
+	"""Writes what the add-on reads from Becky! and the results of its hot paths to a file,
+	so that real navigation can be replayed outside of Windows by `benchmarks/replay.py`.
+
+	The file is gzip compressed, with one JSON object per line.
+	Data entries - content of list view cells, text of the display model and of the status bar,
+	and the first visible item of the folder tree -
+	are followed by entries of the calls which used them, interleaved with events in the order they arrived.
+	Cells of list views are written only when their content differs from what was recorded before.
+	Every entry has the time it was written at, as expiry of caches depends on it.
+	"""
+
+	FORMAT_VERSION = 3
+
+	def __init__(self):
+		super(SessionRecorder, self).__init__()
+		self.isRecording = False
+		self.path = None
+		self._file = None
+		self._lock = threading.Lock()
+		self._listCells = {}
+
+	def start(self, path):
+		import gzip
+		with self._lock:
+			self._file = gzip.open(path, "wb")
+			self.path = path
+			self._listCells.clear()
+			self.isRecording = True
+		self._write({
+			"t": "header",
+			"version": self.FORMAT_VERSION,
+			"localeEncoding": locale.getpreferredencoding(),
+		})
+
+	def stop(self):
+		with self._lock:
+			self.isRecording = False
+			if self._file is not None:
+				self._file.close()
+				self._file = None
+		return self.path
+
+	def _write(self, entry):
+		import json
+		entry["time"] = time.time()
+		line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf8")
+		with self._lock:
+			if self._file is not None:
+				self._file.write(line)
+
+	@staticmethod
+	def _encodeBytes(data):
+		import base64
+		return None if data is None else base64.b64encode(data).decode("ascii")
+
+	def recordListCells(self, windowHandle, texts):
+		"""Records content of `(item, sub-item)` cells, as returned by `RemoteBufferPool.getItemsTexts`."""
+		cells = []
+		with self._lock:
+			for (itemIndex, subItem), data in texts.items():
+				key = (windowHandle, itemIndex, subItem)
+				if key not in self._listCells or self._listCells[key] != data:
+					self._listCells[key] = data
+					cells.append((itemIndex, subItem, self._encodeBytes(data)))
+		if cells:
+			self._write({"t": "listCells", "hwnd": windowHandle, "cells": sorted(cells)})
+
+	def recordScreen(self, windowHandle, rect, text):
+		self._write({
+			"t": "screen",
+			"hwnd": windowHandle,
+			"rect": [rect.left, rect.top, rect.right, rect.bottom],
+			"text": text
+		})
+
+	def recordScreenLines(self, windowHandle, rect, lines):
+		self._write({
+			"t": "screenLines",
+			"hwnd": windowHandle,
+			"rect": [rect.left, rect.top, rect.right, rect.bottom],
+			"lines": [list(line) for line in lines]
+		})
+
+	def recordFirstVisibleTreeItem(self, windowHandle, itemHandle):
+		self._write({"t": "firstVisibleTreeItem", "hwnd": windowHandle, "item": itemHandle})
+
+	def recordEvent(self, eventName, obj):
+		self._write({
+			"t": "event",
+			"name": eventName,
+			"windowClassName": obj.windowClassName,
+			"controlID": obj.windowControlID,
+			"hwnd": obj.windowHandle,
+			"childID": getattr(obj, "IAccessibleChildID", 0),
+			"objName": obj.name if obj.windowClassName == "msctls_statusbar32" else None,
+			# Handlers of events treat objects differently depending on their overlay class.
+			"overlayClass": next(
+				(cls.__name__ for cls in (Message, FolderTreeViewItem, DanaEdit) if isinstance(obj, cls)),
+				None
+			)
+		})
+
+	def recordColumn(self, message, index, text):
+		try:
+			location = list(message._getColumnLocationRaw(index))
+		except Exception:
+			location = None
+		self._write({
+			"t": "column",
+			"hwnd": message.windowHandle,
+			"childID": message.IAccessibleChildID,
+			"index": index,
+			"columnCount": len(message.rowColumnsBytes),
+			"folder": message.appModule.currentFolderName,
+			"location": location,
+			"result": text
+		})
+
+	def recordUnreadInfo(self, treeViewItem, unreadInfo):
+		self._write({
+			"t": "unreadInfo",
+			"hwnd": treeViewItem.windowHandle,
+			"name": treeViewItem.name,
+			"location": list(treeViewItem.location),
+			"treeLocation": list(treeViewItem.treeView.location),
+			"result": unreadInfo
+		})
+
+	def recordUnreadTotal(self, mainWindowHandle, statusBarHandle, unreadInfo, counts):
+		self._write({
+			"t": "unreadTotal",
+			"hwnd": mainWindowHandle,
+			"statusBar": statusBarHandle,
+			"text": unreadInfo,
+			"result": list(counts)
+		})
+
+
+sessionRecorder = SessionRecorder()
+
+
+# Amount of decoded column texts kept in memory.
+DECODED_COLUMNS_CACHE_SIZE = 1024
+
+# Decoded content of message list columns keyed by their raw bytes and column index.
+# Message objects are recreated on every focus change,
+# so without it the same text would be decoded, and compared with the screen, over and over again.
+decodedColumnsCache = LRUCache(DECODED_COLUMNS_CACHE_SIZE)
+
+# Code page guessed for a row of the message list.
+# Columns of a single message nearly always share an encoding,
+# so once it is known for one of them it is tried first for the remaining ones,
+# without comparing them with the screen content.
+rowEncodingMemo = LRUCache(64)
+
+
+class EncodingStatistics(object):
+	"""Keeps track of code pages which were successfully used in a given folder of the message list.
+
+	Encodings are tried in the order of their scores, so that in folders where most messages
+	use, for example, Shift JIS it is tried first.
+	Scores of all encodings used in a folder decay whenever a new success is recorded,
+	so the order adapts when content of the folder changes.
+	"""
+
+	def __init__(self, decay=0.95, maxFolders=128):
+		super(EncodingStatistics, self).__init__()
+		self.decay = decay
+		self._scores = LRUCache(maxFolders)
+		self._lock = threading.Lock()
+
+	def recordSuccess(self, key, encoding):
+		with self._lock:
+			scores = self._scores.get(key)
+			if scores is None:
+				scores = {}
+				self._scores.put(key, scores)
+			for knownEncoding in scores:
+				scores[knownEncoding] *= self.decay
+			scores[encoding] = scores.get(encoding, 0) + 1
+
+	def orderEncodings(self, key, encodings):
+		"""Returns given encodings sorted by their score in the given folder.
+		Encodings with equal scores keep their original order.
+		"""
+		with self._lock:
+			scores = dict(self._scores.get(key) or {})
+		if not scores:
+			return encodings
+		return sorted(encodings, key=lambda encoding: -scores.get(encoding, 0))
+
+	def clear(self):
+		self._scores.clear()
+
+
+encodingStatistics = EncodingStatistics()
+
+
+class CharsetDetector(object):
+	"""Guesses code page of a column of the message list from its bytes alone.
+
+	Every candidate encoding which can decode the data is scored
+	by how plausible the resulting text is for the script it belongs to.
+	Multibyte encodings which split bytes at wrong boundaries produce rare ideographs,
+	half-width katakana or symbols, while single byte encodings applied to the wrong language
+	result in words mixing Latin and Cyrillic letters, or in long runs of accented letters.
+	The guess is returned only if the best candidate is clearly better than any other decoding,
+	otherwise caller has to verify candidates in some other way.
+	Single byte code pages of languages using the same script are hard to tell apart,
+	so a guess in which every byte became one character is not trusted
+	if any other such reading, including ones of `REFERENCE_ENCODINGS`, is plausible as well.
+	Short or implausible data which is valid UTF-8 is often a Chinese or Korean text as well,
+	so it is scored like the other candidates, and not trusted if any of them reads as East Asian text.
+	Every Chinese or Korean character whose bytes are both between 0xA1 and 0xDF
+	is two half-width katakana in Shift-JIS, so when a candidate is made only of them, there is no guess.
+	"""
+
+	MIN_SCORE = 0.6
+	MIN_MARGIN = 0.15
+	# Code pages which are never returned, but whose plausible readings make a single byte guess ambiguous.
+	# Western European one is common in mail, yet is not one of the candidates.
+	REFERENCE_ENCODINGS = ("cp1252",)
+	# Plausible valid UTF-8 with at least this many characters outside of ASCII is almost never anything else.
+	MIN_TRUSTED_UTF8_CHARS = 4
+
+	COMMON_HANZI = frozenset(
+		u"的一是不了人我在有他这中大来上国个到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可"
+		u"她里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已"
+		u"老从动两长知民样现分将外但身些与高意进把法此实回二理美点月明其种声全工己话儿者向情部正名定女问力"
+		u"机给等几很业最间新什打便位因重被走电四第门相次东政海口使教西再平真听世气信北少关并内加化由却代军"
+		u"产入先山五太水万市眼体别处总才场师书比住员九性通目华报立马命张活难神数件安表原车白应路期死常提感"
+		u"金何更反合放做系计或司利受光王果亲界及今京务制解各任至清物台记边共风战干接许八特直服林题建南度统"
+		u"色字请交爱让认算论百义科元社术结六功指思非流每青管夫连远资队跟带花快条院变联言权往展该领传近留红"
+		u"治决周保达办运半候七必城父强步完革深区即求品士转量空众技轻程告江语英基派满式息写识极令收钱党未持"
+		u"取设始版双历越史商千片容研像找友孩站广改议形委早房音际则首单据导影失拿网香似专石若兵校读志观争究"
+		u"包组造视济喜离虽兴切邮件回复转发会议通知测试订单问题请"
+	)
+	COMMON_HANGUL = frozenset(
+		u"이다는의에가을를하고지기사서로한아도수그것요있어나리대니해자시전정라으게보일인우면주만들내부여제"
+		u"스등무상개원적말소장생회동구위성문중경공관신선연세화실드비물람안없거트학발님게되었습니다할까요"
+		u"용금메일답변확인결과보고안내드립니다참석모임오늘내일주간월년번호첨부파일제목회신"
+	)
+
+	def _scoreEastAsianChar(self, ch, code):
+		"""Returns score of a Chinese, Japanese or Korean character, or `None` for characters of other scripts."""
+		if 0x3040 <= code <= 0x30FF:
+			# Hiragana and full-width katakana.
+			return 1.0
+		if 0x4E00 <= code <= 0x9FFF:
+			return 1.0 if ch in self.COMMON_HANZI else 0.4
+		if 0xAC00 <= code <= 0xD7A3:
+			return 1.0 if ch in self.COMMON_HANGUL else 0.3
+		if 0xFF61 <= code <= 0xFF9F:
+			# Half-width katakana and punctuation, rare in mail, but common in wrongly split multibyte text.
+			return 0.0
+		if 0x3000 <= code <= 0x303F or 0xFF01 <= code <= 0xFF5E:
+			# CJK punctuation and full-width forms.
+			return 0.7
+		return None
+
+	def _scoreChar(self, text, index):
+		ch = text[index]
+		code = ord(ch)
+		eastAsianScore = self._scoreEastAsianChar(ch, code)
+		if eastAsianScore is not None:
+			return eastAsianScore
+		if ch.isupper() and index > 0 and text[index - 1].isalpha() and text[index - 1].islower():
+			# Case does not change in the middle of a word.
+			return -0.5
+		if 0x0400 <= code <= 0x04FF:
+			# Cyrillic words do not contain Latin letters.
+			for neighbour in text[max(index - 1, 0):index] + text[index + 1:index + 2]:
+				if neighbour < u"\x80" and neighbour.isalpha():
+					return -0.5
+			if 0x0410 <= code <= 0x044F or code in (0x0401, 0x0451):
+				return 1.0
+			# Letters used only outside of Russian.
+			return 0.3
+		if 0x00C0 <= code <= 0x024F and ch.isalpha():
+			# Accented Latin letters are normally surrounded by ASCII ones.
+			runStart = index
+			while runStart > 0 and text[runStart - 1] >= u"\xc0" and text[runStart - 1].isalpha():
+				runStart -= 1
+			runEnd = index
+			while runEnd < len(text) - 1 and text[runEnd + 1] >= u"\xc0" and text[runEnd + 1].isalpha():
+				runEnd += 1
+			return 0.8 if runEnd - runStart < 4 else 0.3
+		if 0x00A0 <= code <= 0x00BF or 0x2010 <= code <= 0x203A or code == 0x20AC:
+			# Common punctuation, currency and typographic symbols, which do not occur inside words.
+			if 0 < index < len(text) - 1 and text[index - 1].isalpha() and text[index + 1].isalpha():
+				return -0.5
+			return 0.2
+		if 0x0080 <= code <= 0x009F or 0xE000 <= code <= 0xF8FF or code == 0xFFFD:
+			# Control characters, private use area and replacement characters.
+			return -1.0
+		return 0.0
+
+	def scoreText(self, text):
+		"""Returns average plausibility of non ASCII characters in the given text, between -1 and 1."""
+		scores = [self._scoreChar(text, index) for index, ch in enumerate(text) if ch >= u"\x80"]
+		if not scores:
+			return 1.0
+		return sum(scores) / len(scores)
+
+	def detect(self, data, encodings):
+		"""Returns tuple of the encoding and decoded text if one of given encodings is a confident match,
+		or `None` otherwise.
+		Candidates producing the same text are considered equal, and the first of them is returned.
+		"""
+		candidates = []
+		utf8Text = None
+		for encoding in encodings:
+			try:
+				text = data.decode(encoding)
+			except (UnicodeDecodeError, LookupError):
+				continue
+			if any(text == knownText for knownEncoding, knownText, knownScore in candidates):
+				continue
+			score = self.scoreText(text)
+			if encoding.replace("-", "").lower() in ("utf8", "utf_8"):
+				if score >= self.MIN_SCORE and sum(1 for ch in text if ch >= u"\x80") >= self.MIN_TRUSTED_UTF8_CHARS:
+					return encoding, text
+				utf8Text = text
+			candidates.append((encoding, text, score))
+		if not candidates:
+			return None
+		if any(self._isHalfWidthKatakana(text) for encoding, text, score in candidates):
+			return None
+		candidates.sort(key=lambda candidate: -candidate[2])
+		bestEncoding, bestText, bestScore = candidates[0]
+		if bestScore < self.MIN_SCORE:
+			return None
+		if bestText == utf8Text and any(
+			self._isEastAsian(text) for encoding, text, score in candidates[1:]
+		):
+			return None
+		if len(candidates) > 1 and bestScore - candidates[1][2] < self.MIN_MARGIN:
+			return None
+		if len(bestText) == len(data) and self._hasOtherPlausibleSingleByteReading(data, bestText, candidates):
+			return None
+		return bestEncoding, bestText
+
+	def _isEastAsian(self, text):
+		return any(self._scoreEastAsianChar(ch, ord(ch)) is not None for ch in text)
+
+	@staticmethod
+	def _isHalfWidthKatakana(text):
+		"""Returns `True` if all characters of the text outside of ASCII are half-width katakana."""
+		nonAsciiChars = [ch for ch in text if ch >= u"\x80"]
+		return bool(nonAsciiChars) and all(u"\uff61" <= ch <= u"\uff9f" for ch in nonAsciiChars)
+
+	def _hasOtherPlausibleSingleByteReading(self, data, bestText, candidates):
+		readings = [text for encoding, text, score in candidates[1:] if score >= self.MIN_SCORE]
+		for encoding in self.REFERENCE_ENCODINGS:
+			try:
+				text = data.decode(encoding)
+			except UnicodeDecodeError:
+				continue
+			if text != bestText and self.scoreText(text) >= self.MIN_SCORE:
+				readings.append(text)
+		return any(len(text) == len(data) for text in readings)
+
+
+charsetDetector = CharsetDetector()
+
+
+def makeRowKey(windowHandle, itemIndex, rowColumnsBytes):
+	"""Identifies row of the message list by its window, index and content of all its columns."""
+	return (windowHandle, itemIndex, tuple(sorted(rowColumnsBytes.items())))
+
+
+def decodeColumnBytesWithoutScreen(data, rowKey, statisticsKey, encodings):
+	"""Decodes content of a message list column without comparing it with the screen.
+
+	Returns `None` when code page cannot be determined with enough confidence.
+	Since the screen is not touched this is safe to call from any thread.
+	"""
+	try:
+		allCharsInASCIIRange = all(ch < 129 for ch in map(ord, data))  # Python 2
+	except TypeError:
+		allCharsInASCIIRange = all(ch < 129 for ch in data)  # Python 3
+	if allCharsInASCIIRange:
+		return data.decode("ascii")
+	rowEncoding = rowEncodingMemo.get(rowKey)
+	if rowEncoding is not None:
+		try:
+			return data.decode(rowEncoding)
+		except UnicodeDecodeError:
+			pass
+	detected = charsetDetector.detect(data, encodingStatistics.orderEncodings(statisticsKey, encodings))
+	if detected is None:
+		return None
+	encoding, text = detected
+	rowEncodingMemo.put(rowKey, encoding)
+	encodingStatistics.recordSuccess(statisticsKey, encoding)
+	return text
+
+
+class ColumnFetchTimeout(Exception):
+	"""Raised when the column has not been fetched in the given time."""
+
+
+class ColumnFetchCancelled(Exception):
+	"""Raised when fetching the column has been dropped, as the message it belongs to is no longer focused."""
+
+
+class ColumnFuture(object):
+	"""Content of a single column which is being fetched on a worker thread.
+
+	A minimal equivalent of `concurrent.futures.Future`, which is not available in Python 2.
+	`priority` is the highest priority of the jobs which fetch it.
+	"""
+
+	def __init__(self, priority=0):
+		super(ColumnFuture, self).__init__()
+		self.priority = priority
+		self._doneEvent = threading.Event()
+		self._lock = threading.Lock()
+		self._callbacks = []
+		self._result = None
+		self._exception = None
+		self._cancelled = False
+
+	def done(self):
+		return self._doneEvent.is_set()
+
+	def cancelled(self):
+		return self._cancelled
+
+	def failed(self):
+		"""Checks if fetching has finished without providing the content."""
+		return self._cancelled or self._exception is not None
+
+	def _finish(self, result=None, exception=None, cancelled=False):
+		with self._lock:
+			if self._doneEvent.is_set():
+				return
+			self._result = result
+			self._exception = exception
+			self._cancelled = cancelled
+			self._doneEvent.set()
+			callbacks = self._callbacks
+			self._callbacks = []
+		for callback in callbacks:
+			try:
+				callback(self)
+			except Exception:
+				log.error("Error in column fetch callback", exc_info=True)
+
+	def addDoneCallback(self, callback):
+		"""Calls `callback` with this future once it is done, immediately if it already is."""
+		with self._lock:
+			if not self._doneEvent.is_set():
+				self._callbacks.append(callback)
+				return
+		callback(self)
+
+	def result(self, timeout=None):
+		"""Returns content of the column as bytes, waiting at most `timeout` seconds for it to be fetched."""
+		if not self._doneEvent.wait(timeout):
+			raise ColumnFetchTimeout
+		if self._cancelled:
+			raise ColumnFetchCancelled
+		if self._exception is not None:
+			raise self._exception
+		return self._result
+
+
+class ColumnFetcher(object):
+	"""Fetches content of message list columns on worker threads.
+
+	Requests for the same `(window, item, column)` are coalesced into a single future,
+	which is also kept after it is done, so that the content is not fetched again until `invalidate` is called.
+	Rows around the focused message are requested with `PREFETCH_PRIORITY`,
+	and are fetched only when no row needed right now is waiting.
+	Requests made before the last call to `dropStale` are not executed when they reach the worker.
+	`fetchRow(windowHandle, itemIndex, columns)` has to return a dictionary mapping columns to their content.
+	"""
+
+	FOCUSED_ROW_PRIORITY = 0
+	PREFETCH_PRIORITY = 1
+
+	def __init__(self, fetchRow, workersCount=2, maxFutures=1024):
+		super(ColumnFetcher, self).__init__()
+		self._fetchRow = fetchRow
+		self._jobs = queue.PriorityQueue()
+		# Keeps jobs of the same priority in the order they were submitted.
+		self._jobsCount = 0
+		self._futures = LRUCache(maxFutures)
+		self._lock = threading.Lock()
+		self._generation = 0
+		self._currentRow = None
+		self._workers = []
+		for workerIndex in range(workersCount):
+			worker = threading.Thread(target=self._work, name="BeckyColumnFetcher{}".format(workerIndex))
+			worker.daemon = True
+			worker.start()
+			self._workers.append(worker)
+
+	def submitRow(self, windowHandle, itemIndex, columns, priority=FOCUSED_ROW_PRIORITY, onRowFetched=None):
+		"""Requests content of the given columns of one row, returning a dictionary mapping columns to futures.
+
+		Columns which are not being fetched already are read together as one job,
+		as are columns waiting in a job of lower priority.
+		`onRowFetched(windowHandle, itemIndex, row)` is called on the worker thread once the job is done.
+		"""
+		futures = {}
+		columnsToFetch = []
+		with self._lock:
+			for column in columns:
+				key = (windowHandle, itemIndex, column)
+				future = self._futures.get(key)
+				if future is None or future.failed():
+					future = ColumnFuture(priority)
+					self._futures.put(key, future)
+					columnsToFetch.append(column)
+				elif not future.done() and priority < future.priority:
+					future.priority = priority
+					columnsToFetch.append(column)
+				futures[column] = future
+			if columnsToFetch:
+				self._jobsCount += 1
+				self._jobs.put((priority, self._jobsCount, (
+					self._generation,
+					windowHandle,
+					itemIndex,
+					tuple(columnsToFetch),
+					[futures[column] for column in columnsToFetch],
+					onRowFetched
+				)))
+		return futures
+
+	def submit(self, windowHandle, itemIndex, column):
+		return self.submitRow(windowHandle, itemIndex, (column,))[column]
+
+	def prefetchRows(self, windowHandle, itemIndexes, columns, onRowFetched=None):
+		"""Requests the given rows with low priority, so that they are ready when focus moves to them."""
+		for itemIndex in itemIndexes:
+			self.submitRow(windowHandle, itemIndex, columns, self.PREFETCH_PRIORITY, onRowFetched)
+
+	def dropStale(self, currentRow=None):
+		"""Makes requests which have not been started yet to be cancelled, for example because focus has moved.
+
+		Requests for `currentRow`, given as `(windowHandle, itemIndex)`, are still executed.
+		"""
+		with self._lock:
+			self._generation += 1
+			self._currentRow = currentRow
+
+	def invalidate(self):
+		"""Drops pending requests and forgets fetched content, as rows of the list have changed."""
+		with self._lock:
+			self._generation += 1
+			self._currentRow = None
+			self._futures.clear()
+
+	def stop(self):
+		self.dropStale()
+		with self._lock:
+			for worker in self._workers:
+				self._jobsCount += 1
+				# Before any job, so that workers stop as soon as possible.
+				self._jobs.put((self.FOCUSED_ROW_PRIORITY - 1, self._jobsCount, None))
+		self._workers = []
+
+	def _work(self):
+		while True:
+			priority, jobNo, job = self._jobs.get()
+			if job is None:
+				return
+			generation, windowHandle, itemIndex, columns, futures, onRowFetched = job
+			# Columns could have been fetched by a job of higher priority in the meantime.
+			pending = [(column, future) for column, future in zip(columns, futures) if not future.done()]
+			if not pending:
+				continue
+			if generation != self._generation and (windowHandle, itemIndex) != self._currentRow:
+				for column, future in pending:
+					future._finish(cancelled=True)
+				continue
+			try:
+				row = self._fetchRow(windowHandle, itemIndex, tuple(column for column, future in pending))
+			except Exception as e:
+				log.debugWarning("Failed to fetch row {}".format(itemIndex), exc_info=True)
+				for column, future in pending:
+					future._finish(exception=e)
+				continue
+			for column, future in pending:
+				future._finish(result=row.get(column))
+			if onRowFetched is not None and not any(future.failed() for future in futures):
+				try:
+					onRowFetched(windowHandle, itemIndex, dict(
+						(column, future.result(0)) for column, future in zip(columns, futures)
+					))
+				except Exception:
+					log.error("Error in row fetch callback", exc_info=True)
+
+
+class SearchableRows(object):
+	"""Rows of texts with an index of their words, in which rows can be found by prefixes of words."""
+
+	_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+	def __init__(self, windowHandle):
+		super(SearchableRows, self).__init__()
+		self.windowHandle = windowHandle
+		self.rows = []
+		self._rowWords = []
+		self._wordIndex = {}
+		self._sortedWords = None
+
+	def _unindexRow(self, itemIndex):
+		for word in self._rowWords[itemIndex]:
+			rowIndexes = self._wordIndex[word]
+			rowIndexes.discard(itemIndex)
+			if not rowIndexes:
+				del self._wordIndex[word]
+				self._sortedWords = None
+
+	def _indexRow(self, itemIndex):
+		words = set(self._WORD_RE.findall(u" ".join(self.rows[itemIndex]).lower()))
+		self._rowWords[itemIndex] = words
+		for word in words:
+			if word not in self._wordIndex:
+				self._wordIndex[word] = set()
+				self._sortedWords = None
+			self._wordIndex[word].add(itemIndex)
+
+	def _rowsMatchingWord(self, prefix):
+		if self._sortedWords is None:
+			self._sortedWords = sorted(self._wordIndex)
+		rowIndexes = set()
+		for wordPos in range(bisect.bisect_left(self._sortedWords, prefix), len(self._sortedWords)):
+			word = self._sortedWords[wordPos]
+			if not word.startswith(prefix):
+				break
+			rowIndexes.update(self._wordIndex[word])
+		return rowIndexes
+
+	def find(self, query, startIndex, direction=1):
+		"""Returns index of the first row, starting at `startIndex` and wrapping,
+		in which every word of the query starts some word, or `None` if there is no such row.
+		"""
+		queryWords = self._WORD_RE.findall(query.lower())
+		if not queryWords or not self.rows:
+			return None
+		matchingRows = None
+		for queryWord in queryWords:
+			rowIndexes = self._rowsMatchingWord(queryWord)
+			matchingRows = rowIndexes if matchingRows is None else matchingRows & rowIndexes
+			if not matchingRows:
+				return None
+		for distance in range(len(self.rows)):
+			itemIndex = (startIndex + distance * direction) % len(self.rows)
+			if itemIndex in matchingRows:
+				return itemIndex
+		return None
+
+
+class MessageListSnapshot(SearchableRows):
+	"""Decoded content of every message in a list, with an index of words used for searching.
+
+	Raw content of rows is read in bulk, in chunks of `FETCH_CHUNK_SIZE` rows.
+	Rows which fired events are marked as outdated, and on refresh only they are read again,
+	together with messages added at the beginning or at the end of the list,
+	which is checked by comparing the first, middle and last known row with what is at their new positions.
+	Every row is read again if the folder changed, or if the whole list has been marked as outdated
+	and messages have not been just added to it.
+	Only rows whose content really changed are decoded and indexed again.
+	"""
+
+	FETCH_CHUNK_SIZE = 64
+
+	def __init__(self, windowHandle):
+		super(MessageListSnapshot, self).__init__(windowHandle)
+		self._rowsBytes = []
+		self._statisticsKey = None
+		self._outdatedRows = set()
+		self._isOutdated = True
+
+	def markOutdated(self, childID=0):
+		"""Marks row with the given IAccessible child ID, or the whole list for 0, as outdated."""
+		if childID:
+			self._outdatedRows.add(childID - 1)
+		else:
+			self._isOutdated = True
+
+	def _fetchRowsBytes(self, pool, LVITEM, itemIndexes, columnCount):
+		"""Returns raw content of the given rows, as a dictionary keyed by their indexes."""
+		rowsBytes = {}
+		for chunkStart in range(0, len(itemIndexes), self.FETCH_CHUNK_SIZE):
+			chunkIndexes = itemIndexes[chunkStart:chunkStart + self.FETCH_CHUNK_SIZE]
+			texts = pool.getItemsTexts(
+				self.windowHandle,
+				LVITEM,
+				[(itemIndex, colIndex) for itemIndex in chunkIndexes for colIndex in range(columnCount)]
+			)
+			for itemIndex in chunkIndexes:
+				rowsBytes[itemIndex] = tuple(texts[(itemIndex, colIndex)] for colIndex in range(columnCount))
+		return rowsBytes
+
+	def _findAddedRowsPosition(self, pool, LVITEM, itemCount, columnCount):
+		"""Returns index at which messages have been added to the list since the previous refresh,
+		or `None` if messages could have been inserted or removed anywhere.
+		"""
+		knownCount = len(self._rowsBytes)
+		if not knownCount or itemCount <= knownCount:
+			return None
+		knownBoundaries = sorted(set((0, knownCount // 2, knownCount - 1)))
+		for position in (knownCount, 0):
+			# Messages added at the end leave known rows where they were, added at the beginning move them down.
+			offset = itemCount - knownCount if position == 0 else 0
+			rowsBytes = self._fetchRowsBytes(
+				pool,
+				LVITEM,
+				[offset + itemIndex for itemIndex in knownBoundaries],
+				columnCount
+			)
+			if all(rowsBytes[offset + itemIndex] == self._rowsBytes[itemIndex] for itemIndex in knownBoundaries):
+				return position
+		return None
+
+	def _insertUnreadRows(self, itemIndex, count):
+		"""Inserts rows which have not been read yet, moving the following rows and their words in the index."""
+		self._rowsBytes[itemIndex:itemIndex] = [None] * count
+		self.rows[itemIndex:itemIndex] = [None] * count
+		self._rowWords[itemIndex:itemIndex] = [set() for newRow in range(count)]
+		if itemIndex + count < len(self._rowWords):
+			self._wordIndex = {}
+			for rowIndex, words in enumerate(self._rowWords):
+				for word in words:
+					self._wordIndex.setdefault(word, set()).add(rowIndex)
+
+	@staticmethod
+	def _decodeRow(windowHandle, itemIndex, rowBytes, statisticsKey, encodings):
+		rowKey = makeRowKey(windowHandle, itemIndex, dict(enumerate(rowBytes)))
+		rowTexts = []
+		for colIndex, data in enumerate(rowBytes):
+			if not data:
+				rowTexts.append(u"")
+				continue
+			text = decodedColumnsCache.get((data, colIndex))
+			if text is None:
+				text = decodeColumnBytesWithoutScreen(data, rowKey, statisticsKey, encodings)
+			if text is None:
+				# Rows outside of the screen cannot be verified, use the most likely code page.
+				for encoding in encodingStatistics.orderEncodings(statisticsKey, encodings):
+					try:
+						text = data.decode(encoding)
+						break
+					except UnicodeDecodeError:
+						continue
+				else:
+					text = data.decode("utf8", "replace")
+			rowTexts.append(text)
+		return tuple(rowTexts)
+
+	def refresh(self, pool, LVITEM, columnCount, statisticsKey, encodings):
+		"""Reads content of outdated rows of the list, and updates rows which changed since the previous refresh.
+		Returns amount of updated rows.
+		"""
+		itemCount = watchdog.cancellableSendMessage(self.windowHandle, LVM_GETITEMCOUNT, 0, 0)
+		markedRows = set(itemIndex for itemIndex in self._outdatedRows if itemIndex < itemCount)
+		addedRowsPosition = None
+		if statisticsKey == self._statisticsKey and itemCount != len(self._rowsBytes):
+			addedRowsPosition = self._findAddedRowsPosition(pool, LVITEM, itemCount, columnCount)
+		addedCount = itemCount - len(self._rowsBytes)
+		if addedRowsPosition is not None:
+			outdatedRows = sorted(markedRows.union(range(addedRowsPosition, addedRowsPosition + addedCount)))
+		elif self._isOutdated or itemCount != len(self._rowsBytes) or statisticsKey != self._statisticsKey:
+			# Messages could be inserted or removed anywhere in the list, so every row may be different.
+			outdatedRows = list(range(itemCount))
+		else:
+			outdatedRows = sorted(markedRows)
+		rowsBytes = self._fetchRowsBytes(pool, LVITEM, outdatedRows, columnCount)
+		if addedRowsPosition is not None:
+			self._insertUnreadRows(addedRowsPosition, addedCount)
+		self._isOutdated = False
+		self._outdatedRows = set()
+		self._statisticsKey = statisticsKey
+		for itemIndex in range(itemCount, len(self._rowsBytes)):
+			self._unindexRow(itemIndex)
+		del self._rowsBytes[itemCount:]
+		del self.rows[itemCount:]
+		del self._rowWords[itemCount:]
+		updatedRows = 0
+		for itemIndex in outdatedRows:
+			rowBytes = rowsBytes[itemIndex]
+			if itemIndex < len(self._rowsBytes):
+				if self._rowsBytes[itemIndex] == rowBytes:
+					continue
+				self._unindexRow(itemIndex)
+				self._rowsBytes[itemIndex] = rowBytes
+			else:
+				self._rowsBytes.append(rowBytes)
+				self.rows.append(None)
+				self._rowWords.append(set())
+			self.rows[itemIndex] = self._decodeRow(self.windowHandle, itemIndex, rowBytes, statisticsKey, encodings)
+			self._indexRow(itemIndex)
+			updatedRows += 1
+		return updatedRows
+
+
+class MessageSearch(object):
+	"""Incremental type-ahead search in the message list.
+
+	While it is active typed characters extend the searched text, and the first matching message is selected.
+	"""
+
+	def __init__(self, appModule, snapshot, LVITEM, startIndex):
+		super(MessageSearch, self).__init__()
+		self.appModule = appModule
+		self.snapshot = snapshot
+		self.LVITEM = LVITEM
+		self.query = u""
+		self.currentIndex = startIndex
+
+	def _selectRow(self, itemIndex):
+		pool = self.appModule.getRemoteBufferPool()
+		windowHandle = self.snapshot.windowHandle
+		pool.setItemState(windowHandle, self.LVITEM, -1, 0, LVIS_SELECTED)
+		pool.setItemState(
+			windowHandle,
+			self.LVITEM,
+			itemIndex,
+			LVIS_FOCUSED | LVIS_SELECTED,
+			LVIS_FOCUSED | LVIS_SELECTED
+		)
+		watchdog.cancellableSendMessage(windowHandle, LVM_ENSUREVISIBLE, itemIndex, 0)
+		self.currentIndex = itemIndex
+
+	def _search(self, startIndex, direction=1):
+		itemIndex = self.snapshot.find(self.query, startIndex, direction)
+		if itemIndex is None:
+			ui.message(u"No match for {}".format(self.query))
+		elif itemIndex == self.currentIndex:
+			ui.message(u" ".join(text for text in self.snapshot.rows[itemIndex] if text))
+		else:
+			self._selectRow(itemIndex)
+
+	def getScript(self, gesture):
+		"""Returns script handling the given gesture while searching,
+		or `None` for gestures which end the search.
+		"""
+		keyName = getattr(gesture, "mainKeyName", "")
+		modifiers = getattr(gesture, "modifierNames", ())
+		if keyName == "escape" and not modifiers:
+			return self.script_cancel
+		if keyName == "enter" and not modifiers:
+			return self.script_finish
+		if keyName == "backspace" and not modifiers:
+			return self.script_removeCharacter
+		if keyName == "f3":
+			return self.script_previousMatch if "shift" in modifiers else self.script_nextMatch
+		if self._getTypedCharacter(gesture) is not None:
+			return self.script_typeCharacter
+		self.appModule.endMessageSearch()
+		return None
+
+	@staticmethod
+	def _getTypedCharacter(gesture):
+		modifiers = set(getattr(gesture, "modifierNames", ()))
+		if not modifiers <= {"shift"}:
+			return None
+		keyName = getattr(gesture, "mainKeyName", "")
+		if keyName == "space":
+			return u" "
+		character = getattr(gesture, "character", None) or keyName
+		if len(character) == 1:
+			return character
+		return None
+
+	def script_typeCharacter(self, gesture):
+		self.query += self._getTypedCharacter(gesture)
+		self._search(self.currentIndex)
+
+	def script_removeCharacter(self, gesture):
+		self.query = self.query[:-1]
+		if self.query:
+			self._search(self.currentIndex)
+		else:
+			ui.message("Search text empty")
+
+	def script_nextMatch(self, gesture):
+		self._search(self.currentIndex + 1)
+
+	def script_previousMatch(self, gesture):
+		self._search(self.currentIndex - 1, direction=-1)
+
+	def script_finish(self, gesture):
+		self.appModule.endMessageSearch()
+		ui.message("Search finished")
+
+	def script_cancel(self, gesture):
+		self.appModule.endMessageSearch()
+		ui.message("Search cancelled")
+
+
 class EnhancedGetter(object):
 
 	def __init__(self, modWithAttrs, attrCommonPrefix, alternativeNameFactories):
@@ -53,9 +1348,13 @@ class EnhancedGetter(object):
 	def __getattr__(self, attrName):
 		for aliasNameMaker in self.alternativeNameFactories:
 			try:
-				return operator.attrgetter(aliasNameMaker(self.attrCommonPrefix, attrName))(self.mod)
+				value = operator.attrgetter(aliasNameMaker(self.attrCommonPrefix, attrName))(self.mod)
 			except AttributeError:
 				continue
+			# Store the resolved value on the instance,
+			# so that subsequent lookups are plain attribute reads which never reach `__getattr__`.
+			setattr(self, attrName, value)
+			return value
 		raise AttributeError("Attribute {} not found!".format(attrName))
 
 
@@ -93,25 +1392,98 @@ class StatusBarNotVisible(Exception):
 	pass
 
 
-def getUnreadTotalCount():
-	""" Returns unread vs total count of a messages in a current folder. """
-	try:
-		statusBarHandle = windowUtils.findDescendantWindow(
-			api.getForegroundObject().windowHandle, visible=True, className="msctls_statusbar32"
-		)
-	except LookupError:
-		raise StatusBarNotVisible
-	statusBarObj = NVDAObjects.IAccessible.getNVDAObjectFromEvent(statusBarHandle, winUser.OBJID_CLIENT, 0)
-	unreadInfo = ''
-	for child in statusBarObj.children:
-		if child.name is not None and child.name.startswith('Unread:'):
-			unreadInfo = child.name
-			break
-	if unreadInfo == '':
-		raise NoUnreadInfo
+def parseUnreadInfo(unreadInfo):
+	""" Converts text of the status bar part such as `Unread: 3 Total: 10`
+	to a tuple of unread and total count.
+	"""
 	return int(unreadInfo.split()[1]), int(unreadInfo.split()[-1])
 
 
+class StatusBarReader(object):
+	""" Retrieves unread info from the status bar of a Becky! main window.
+
+	Handle of the status bar and ID of the part containing unread info are remembered,
+	and looked up again only when they are no longer valid.
+	Name changes of that part can be fed to this object, so that the latest counts are known without polling.
+	"""
+
+	UNREAD_INFO_PREFIX = 'Unread:'
+
+	def __init__(self, mainWindowHandle):
+		super(StatusBarReader, self).__init__()
+		self.mainWindowHandle = mainWindowHandle
+		self.latestCounts = None
+		self.latestCountsFolder = None
+		self._statusBarHandle = None
+		self._unreadInfoChildID = None
+
+	def _getStatusBarHandle(self):
+		statusBarHandle = self._statusBarHandle
+		if (
+			statusBarHandle is None
+			or not winUser.isWindow(statusBarHandle)
+			or not winUser.isWindowVisible(statusBarHandle)
+		):
+			import windowUtils
+			self._statusBarHandle = self._unreadInfoChildID = None
+			try:
+				statusBarHandle = windowUtils.findDescendantWindow(
+					self.mainWindowHandle, visible=True, className="msctls_statusbar32"
+				)
+			except LookupError:
+				raise StatusBarNotVisible
+			self._statusBarHandle = statusBarHandle
+		return statusBarHandle
+
+	def _getUnreadInfo(self, statusBarHandle):
+		if self._unreadInfoChildID is not None:
+			child = NVDAObjects.IAccessible.getNVDAObjectFromEvent(
+				statusBarHandle, winUser.OBJID_CLIENT, self._unreadInfoChildID
+			)
+			if child and child.name and child.name.startswith(self.UNREAD_INFO_PREFIX):
+				return child.name
+		statusBarObj = NVDAObjects.IAccessible.getNVDAObjectFromEvent(statusBarHandle, winUser.OBJID_CLIENT, 0)
+		for child in statusBarObj.children:
+			if child.name is not None and child.name.startswith(self.UNREAD_INFO_PREFIX):
+				self._unreadInfoChildID = child.IAccessibleChildID
+				return child.name
+		self._unreadInfoChildID = None
+		raise NoUnreadInfo
+
+	def getUnreadTotalCount(self):
+		statusBarHandle = self._getStatusBarHandle()
+		unreadInfo = self._getUnreadInfo(statusBarHandle)
+		self.latestCounts = parseUnreadInfo(unreadInfo)
+		if sessionRecorder.isRecording:
+			sessionRecorder.recordUnreadTotal(self.mainWindowHandle, statusBarHandle, unreadInfo, self.latestCounts)
+		return self.latestCounts
+
+	def handleNameChange(self, obj, folder):
+		""" Remembers counts from a status bar part whose name has changed, for the given listed folder.
+		Returns previously known counts if they were for the same folder and are different than the new ones,
+		`None` otherwise.
+		"""
+		name = obj.name
+		if not name or not name.startswith(self.UNREAD_INFO_PREFIX):
+			return None
+		self._statusBarHandle = obj.windowHandle
+		self._unreadInfoChildID = obj.IAccessibleChildID
+		previousCounts = self.latestCounts if self.latestCountsFolder == folder else None
+		self.latestCounts = parseUnreadInfo(name)
+		self.latestCountsFolder = folder
+		if previousCounts == self.latestCounts:
+			return None
+		return previousCounts
+
+
+@timed("getUnreadTotalCount")
+def getUnreadTotalCount(statusBarReader=None):
+	""" Returns unread vs total count of a messages in a current folder. """
+	if statusBarReader is None:
+		statusBarReader = StatusBarReader(api.getForegroundObject().windowHandle)
+	return statusBarReader.getUnreadTotalCount()
+
+
 class BeckyMainFrame(IAccessible):
 
 	@script(
@@ -122,7 +1494,7 @@ class BeckyMainFrame(IAccessible):
 	)
 	def script_unreadTotalInfo(self, gesture):
 		try:
-			result = getUnreadTotalCount()
+			result = getUnreadTotalCount(self.appModule.getStatusBarReader(self.windowHandle))
 			if all(item == 0 for item in result):
 				msg = "Empty folder"
 			elif result[0] == 0:
@@ -135,9 +1507,90 @@ class BeckyMainFrame(IAccessible):
 			msg = "Cannot locate unread info in the status bar"
 		ui.message(msg)
 
+	@script(
+		gesture="kb:NVDA+control+shift+U",
+		canPropagate=True,
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Reports amount of unread messages in all folders visible in the folder tree"
+	)
+	def script_allFoldersUnreadInfo(self, gesture):
+		import windowUtils
+		try:
+			treeViewHandle = windowUtils.findDescendantWindow(
+				api.getForegroundObject().windowHandle, visible=True, className="SysTreeView32", controlID=1000
+			)
+		except LookupError:
+			ui.message("Folder tree is not visible")
+			return
+		treeView = NVDAObjects.IAccessible.getNVDAObjectFromEvent(treeViewHandle, winUser.OBJID_CLIENT, 0)
+		unreadCount, foldersCount, collapsedWithUnread = self.appModule.getFolderTreeSnapshot(
+			treeView,
+			refresh=True
+		).getTotals()
+		if unreadCount:
+			msg = "{} unread in {} folders".format(unreadCount, foldersCount)
+		else:
+			msg = "No unread messages in visible folders"
+		if collapsedWithUnread:
+			msg += ", {} collapsed folders contain unread messages".format(collapsedWithUnread)
+		ui.message(msg)
+
+	@script(
+		gesture="kb:NVDA+alt+U",
+		canPropagate=True,
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Toggles automatic announcement of new messages arriving to the current folder"
+	)
+	def script_toggleUnreadChangesAnnouncement(self, gesture):
+		self.appModule.announceNewMessages = not self.appModule.announceNewMessages
+		if self.appModule.announceNewMessages:
+			ui.message("Announce new messages on")
+		else:
+			ui.message("Announce new messages off")
+
 
 class BeckyComposeFrame(IAccessible):
 
+	def _getAttachmentsList(self):
+		"""Returns list of attachments of the current message, or raises `LookupError` if it is not visible."""
+		attachmentsListObj = NVDAObjects.IAccessible.getNVDAObjectFromEvent(
+			self.appModule.getAttachmentsListHandle(api.getForegroundObject().windowHandle),
+			winUser.OBJID_CLIENT,
+			0
+		)
+		if CTWRAPPER.State.INVISIBLE in attachmentsListObj.parent.states:
+			raise LookupError("Attachments list is hidden")
+		return attachmentsListObj
+
+	def _readAttachments(self, attachmentsListObj):
+		"""Returns content of all columns of all attachments, read in one batch from the list view."""
+		windowHandle = attachmentsListObj.windowHandle
+		itemCount = watchdog.cancellableSendMessage(windowHandle, LVM_GETITEMCOUNT, 0, 0)
+		firstItem = attachmentsListObj.firstChild
+		if not itemCount or firstItem is None:
+			return []
+		columns = range(attachmentsListObj.columnCount or 1)
+		texts = self.appModule.getRemoteBufferPool().getItemsTexts(
+			windowHandle,
+			firstItem.LVITEM,
+			[(itemIndex, column) for itemIndex in range(itemCount) for column in columns]
+		)
+		attachments = []
+		for itemIndex in range(itemCount):
+			row = dict((column, texts[(itemIndex, column)]) for column in columns)
+			rowKey = makeRowKey(windowHandle, itemIndex, row)
+			attachmentTexts = []
+			for column in columns:
+				data = row[column]
+				if not data:
+					continue
+				text = decodeColumnBytesWithoutScreen(data, rowKey, (windowHandle, None), Message.POSSIBLE_ENCODINGS)
+				if text is None:
+					text = data.decode(locale.getpreferredencoding(), "replace")
+				attachmentTexts.append(text)
+			attachments.append(attachmentTexts)
+		return attachments
+
 	@script(
 		gestures=["kb(desktop):NVDA+shift+a", "kb(laptop):NVDA+shift+control+a"],
 		canPropagate=True,
@@ -145,23 +1598,345 @@ class BeckyComposeFrame(IAccessible):
 		description="Moves focus to the list of attachments if it is visible"
 	)
 	def script_focusAttachmentsList(self, gesture):
-		attachmentsListFound = False
 		try:
-			attachmentsListHandle = windowUtils.findDescendantWindow(
-				api.getForegroundObject().windowHandle, visible=True, className="SysListView32", controlID=1002
-			)
-			attachmentsListObj = NVDAObjects.IAccessible.getNVDAObjectFromEvent(
-				attachmentsListHandle, winUser.OBJID_CLIENT, 0
-			)
-			if CTWRAPPER.State.INVISIBLE in attachmentsListObj.parent.states:
-				attachmentsListFound = False
-			else:
-				attachmentsListFound = True
-				attachmentsListObj.firstChild.setFocus()
+			firstAttachment = self._getAttachmentsList().firstChild
+		except LookupError:
+			firstAttachment = None
+		if firstAttachment is None:
+			ui.message("Current message has no attachments")
+			return
+		firstAttachment.setFocus()
+
+	@script(
+		gesture="kb:NVDA+alt+a",
+		canPropagate=True,
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Reports amount of attachments of the current message, together with their names and sizes"
+	)
+	def script_reportAttachments(self, gesture):
+		try:
+			attachments = self._readAttachments(self._getAttachmentsList())
 		except LookupError:
-			attachmentsListFound = False
-		if not attachmentsListFound:
+			attachments = []
+		if not attachments:
 			ui.message("Current message has no attachments")
+			return
+		ui.message("{} attachments: {}".format(
+			len(attachments),
+			", ".join(" ".join(attachmentTexts) for attachmentTexts in attachments)
+		))
+
+
+def wideStringLength(text):
+	"""Length of the text in UTF-16 code units, which are used for offsets in the display model."""
+	return len(text.encode("utf_16_le")) // 2
+
+
+# Color of the text selected in Becky!'s editor and message viewer.
+DANA_HIGHLIGHT_COLOR = RGB(red=255, green=255, blue=255)
+
+
+class StoryOffsetIndex(object):
+	"""Offsets of text chunks in the story of a display model, and spans of highlighted runs of text.
+
+	Built in a single pass over the fields, afterwards offsets can be looked up with a binary search.
+	Text of a range is assembled only from the chunks overlapping it,
+	so reading a line costs the same no matter how much text the story contains.
+	"""
+
+	def __init__(self, fields, highlightColor):
+		super(StoryOffsetIndex, self).__init__()
+		self.chunks = []
+		self.chunkStarts = []
+		self.highlightRuns = []
+		self._storyText = None
+		curOffset = 0
+		inHighlightChunk = False
+		for item in fields:
+			if (
+				isinstance(item, textInfos.FieldCommand)
+				and item.command == "formatChange"
+				and item.field.get('color', None) == highlightColor
+			):
+				inHighlightChunk = True
+			elif isinstance(item, STRING_TYPES):
+				chunkStart = curOffset
+				curOffset += wideStringLength(item)
+				self.chunks.append(item)
+				self.chunkStarts.append(chunkStart)
+				if inHighlightChunk:
+					if self.highlightRuns and self.highlightRuns[-1][1] == chunkStart:
+						self.highlightRuns[-1] = (self.highlightRuns[-1][0], curOffset)
+					else:
+						self.highlightRuns.append((chunkStart, curOffset))
+			else:
+				inHighlightChunk = False
+		self.storyLength = curOffset
+
+	@property
+	def storyText(self):
+		if self._storyText is None:
+			self._storyText = u"".join(self.chunks)
+		return self._storyText
+
+	def getTextRange(self, start, end):
+		"""Returns text between the given offsets, which are in UTF-16 code units like all offsets of the index."""
+		pieces = []
+		for chunkIndex in range(self.getChunkIndex(start), len(self.chunks)):
+			chunkStart = self.chunkStarts[chunkIndex]
+			if chunkStart >= end:
+				break
+			chunk = self.chunks[chunkIndex]
+			rangeStart = max(start - chunkStart, 0)
+			rangeEnd = end - chunkStart
+			if wideStringLength(chunk) == len(chunk):
+				pieces.append(chunk[rangeStart:rangeEnd])
+			else:
+				# Characters outside of the BMP take two code units.
+				pieces.append(chunk.encode("utf_16_le")[rangeStart * 2:rangeEnd * 2].decode("utf_16_le", "replace"))
+		return u"".join(pieces)
+
+	def getSelectionOffsets(self):
+		"""Returns start of the first and end of the last highlighted run, or `None` if nothing is highlighted."""
+		if not self.highlightRuns:
+			return None
+		return self.highlightRuns[0][0], self.highlightRuns[-1][1]
+
+	def getChunkIndex(self, offset):
+		"""Returns index of the text chunk containing given offset."""
+		return max(bisect.bisect_right(self.chunkStarts, offset) - 1, 0)
+
+	def getHighlightRunAt(self, offset):
+		"""Returns `(start, end)` of the highlighted run containing given offset, or `None`."""
+		runIndex = bisect.bisect_right(self.highlightRuns, (offset, float("inf"))) - 1
+		if runIndex >= 0 and self.highlightRuns[runIndex][0] <= offset < self.highlightRuns[runIndex][1]:
+			return self.highlightRuns[runIndex]
+		return None
+
+
+# Color used by Becky! for links in the message viewer.
+DANA_LINK_COLOR = RGB(red=0, green=0, blue=192)
+
+
+class LinkIndex(object):
+	"""Links in a display model story, found in a single pass over its fields.
+
+	Consecutive chunks of text drawn in the link color are merged into one link.
+	"""
+
+	Link = collections.namedtuple("Link", ("startOffset", "endOffset", "text", "underlined"))
+
+	def __init__(self, fields, linkColor):
+		super(LinkIndex, self).__init__()
+		self.links = []
+		curOffset = 0
+		isLink = False
+		underlined = False
+		for item in fields:
+			if isinstance(item, textInfos.FieldCommand):
+				if item.command == "formatChange":
+					isLink = item.field.get('color', None) == linkColor
+					underlined = bool(item.field.get('underline', False))
+				else:
+					isLink = False
+			elif isinstance(item, STRING_TYPES):
+				chunkStart = curOffset
+				curOffset += wideStringLength(item)
+				if not isLink:
+					continue
+				if self.links and self.links[-1].endOffset == chunkStart:
+					lastLink = self.links[-1]
+					self.links[-1] = lastLink._replace(endOffset=curOffset, text=lastLink.text + item)
+				else:
+					self.links.append(self.Link(chunkStart, curOffset, item, underlined))
+		self._linkStarts = [link.startOffset for link in self.links]
+
+	def getLinkAt(self, offset):
+		linkIndex = bisect.bisect_right(self._linkStarts, offset) - 1
+		if linkIndex >= 0 and offset < self.links[linkIndex].endOffset:
+			return self.links[linkIndex]
+		return None
+
+	def getNextLink(self, offset):
+		linkIndex = bisect.bisect_right(self._linkStarts, offset)
+		if linkIndex < len(self.links):
+			return self.links[linkIndex]
+		return None
+
+	def getPreviousLink(self, offset):
+		linkIndex = bisect.bisect_left(self._linkStarts, offset) - 1
+		if linkIndex >= 0:
+			return self.links[linkIndex]
+		return None
+
+
+class QuoteIndex(object):
+	"""Runs of lines quoted to the same depth, and starts of paragraphs, in a display model story.
+
+	Built in a single pass over the fields.
+	Lines with no text take depth of the line before them, so that blank lines between quoted paragraphs
+	do not split a quote into several runs.
+	For every run the closest following unquoted run is precomputed,
+	so skipping past a quote does not need to look at the runs in between.
+	"""
+
+	Run = collections.namedtuple("Run", ("startOffset", "endOffset", "depth", "firstLineEnd"))
+	Paragraph = collections.namedtuple("Paragraph", ("startOffset", "firstLineEnd"))
+
+	QUOTE_MARKER = ">"
+	QUOTE_PREFIX_CHARS = "> \t"
+
+	def __init__(self, fields):
+		super(QuoteIndex, self).__init__()
+		self.runs = []
+		self.paragraphs = []
+		self._prevDepth = 0
+		self._prevBlank = True
+		self._lineStart = 0
+		self._linePrefix = u""
+		self._inPrefix = True
+		curOffset = 0
+		for item in fields:
+			if not isinstance(item, STRING_TYPES):
+				continue
+			lines = item.split(u"\n")
+			for lineNo, piece in enumerate(lines):
+				if lineNo > 0:
+					# The line break belongs to the line it ends.
+					curOffset += 1
+					self._endLine(curOffset)
+					self._lineStart = curOffset
+				if self._inPrefix:
+					rest = piece.lstrip(self.QUOTE_PREFIX_CHARS + u"\r")
+					self._linePrefix += piece[:len(piece) - len(rest)]
+					self._inPrefix = not rest
+				curOffset += wideStringLength(piece)
+		if curOffset > self._lineStart:
+			self._endLine(curOffset)
+		self.storyLength = curOffset
+		self._runStarts = [run.startOffset for run in self.runs]
+		self._paragraphStarts = [paragraph.startOffset for paragraph in self.paragraphs]
+		self._nextUnquotedRuns = [None] * len(self.runs)
+		nextUnquotedRun = None
+		for runIndex in range(len(self.runs) - 1, -1, -1):
+			self._nextUnquotedRuns[runIndex] = nextUnquotedRun
+			if self.runs[runIndex].depth == 0:
+				nextUnquotedRun = runIndex
+
+	def _endLine(self, lineEnd):
+		isBlank = self._inPrefix
+		depth = self._prevDepth if isBlank else self._linePrefix.count(self.QUOTE_MARKER)
+		if self.runs and self.runs[-1].depth == depth:
+			self.runs[-1] = self.runs[-1]._replace(endOffset=lineEnd)
+		else:
+			self.runs.append(self.Run(self._lineStart, lineEnd, depth, lineEnd))
+		if not isBlank and (self._prevBlank or depth != self._prevDepth):
+			self.paragraphs.append(self.Paragraph(self._lineStart, lineEnd))
+		self._prevDepth = depth
+		self._prevBlank = isBlank
+		self._linePrefix = u""
+		self._inPrefix = True
+
+	def _getRunIndex(self, offset):
+		return max(bisect.bisect_right(self._runStarts, offset) - 1, 0)
+
+	def getRunAt(self, offset):
+		if not self.runs:
+			return None
+		return self.runs[self._getRunIndex(offset)]
+
+	def getNextRun(self, offset):
+		"""Returns run which starts where the quote level next changes after the given offset, or `None`."""
+		runIndex = bisect.bisect_right(self._runStarts, offset)
+		if runIndex < len(self.runs):
+			return self.runs[runIndex]
+		return None
+
+	def getPreviousRun(self, offset):
+		"""Returns the run before the one containing given offset, or `None`."""
+		if not self.runs:
+			return None
+		runIndex = self._getRunIndex(offset) - 1
+		if runIndex >= 0:
+			return self.runs[runIndex]
+		return None
+
+	def getRunAfterQuote(self, offset):
+		"""Returns first unquoted run following the quote containing given offset.
+
+		`None` is returned if the offset is not quoted, or if the quote lasts until the end of the story.
+		"""
+		if not self.runs:
+			return None
+		runIndex = self._getRunIndex(offset)
+		if self.runs[runIndex].depth == 0:
+			return None
+		nextUnquotedRun = self._nextUnquotedRuns[runIndex]
+		if nextUnquotedRun is None:
+			return None
+		return self.runs[nextUnquotedRun]
+
+	def getNextParagraph(self, offset):
+		paragraphIndex = bisect.bisect_right(self._paragraphStarts, offset)
+		if paragraphIndex < len(self.paragraphs):
+			return self.paragraphs[paragraphIndex]
+		return None
+
+	def getPreviousParagraph(self, offset):
+		paragraphIndex = bisect.bisect_left(self._paragraphStarts, offset) - 1
+		if paragraphIndex >= 0:
+			return self.paragraphs[paragraphIndex]
+		return None
+
+
+def getStoryIndex(cache, fields, indexFactory):
+	"""Returns index of the given display model fields stored in the cache, building it if necessary.
+
+	Index is keyed by identity of the fields list, which is kept alive by the cache,
+	so it is built once for every read of the display model.
+	"""
+	cached = cache.get(id(fields))
+	if cached is None or cached[0] is not fields:
+		cached = (fields, indexFactory(fields))
+		cache.put(id(fields), cached)
+	return cached[1]
+
+
+class StoryFieldsCache(object):
+	"""Fields and rectangles of display model stories, kept per window and shared by all its text infos.
+
+	The story read for a window is reused as long as it is requested for the same rectangle
+	and with the same change signal, such as position of the caret and text of the line it is on,
+	until it is dropped because the window reported a change, or `maxAge` seconds pass.
+	"""
+
+	def __init__(self, maxWindows=8, maxAge=STORY_FIELDS_MAX_AGE, clock=time.time):
+		super(StoryFieldsCache, self).__init__()
+		self._stories = LRUCache(maxWindows)
+		self.maxAge = maxAge
+		self._clock = clock
+
+	def get(self, windowHandle, changeSignal, readStory):
+		"""Returns story of the given window, calling `readStory` if it is not cached or is outdated."""
+		now = self._clock()
+		cached = self._stories.get(windowHandle)
+		if cached is not None and cached[0] == changeSignal and now - cached[1] < self.maxAge:
+			return cached[2]
+		story = readStory()
+		self._stories.put(windowHandle, (changeSignal, now, story))
+		return story
+
+	def drop(self, windowHandle):
+		self._stories.pop(windowHandle)
+
+
+storyFieldsCache = StoryFieldsCache()
+
+
+# Offset, link and quote indexes of recently read display model stories.
+storyOffsetIndexes = LRUCache(16)
+linkIndexes = LRUCache(16)
+quoteIndexes = LRUCache(16)
 
 
 class DanaTextInfo(EditableTextDisplayModelTextInfo):
@@ -172,35 +1947,77 @@ class DanaTextInfo(EditableTextDisplayModelTextInfo):
 	this is going to be reduced to just one line.
 	"""
 
-	minHorizontalWhitespace = 10
+	minHorizontalWhitespace = 10
+
+	_cache__storyChangeSignal = True
+
+	def _get__storyChangeSignal(self):
+		"""Position of the caret together with text of the line it is on, or `None` when there is no caret.
+
+		Both are much cheaper to retrieve than the story.
+		Position alone is not enough, as it stays the same when a character is deleted,
+		or when another message is shown in the viewer.
+		"""
+		try:
+			caretRect = getCaretRect(self.obj)
+		except RuntimeError:
+			return None
+		if caretRect is None:
+			return None
+		left, top, width, height = self.obj.location
+		caretLine = DisplayModelTextInfo(
+			self.obj,
+			makeRect(left, caretRect.top, left + width, caretRect.bottom)
+		).text
+		return (caretRect, caretLine)
+
+	def _get__storyFieldsAndRects(self):
+		"""Story fields and rectangles are read once and shared by all text infos of the window.
+
+		Moving the caret or editing usually changes what is highlighted, or scrolls the window,
+		so the story is reused only as long as the change signal stays the same.
+		"""
+		changeSignal = self._storyChangeSignal
+		if changeSignal is None:
+			return super(DanaTextInfo, self)._get__storyFieldsAndRects()
+		return storyFieldsCache.get(
+			self.obj.windowHandle,
+			(self._location, changeSignal),
+			super(DanaTextInfo, self)._get__storyFieldsAndRects
+		)
+
+	def _get__storyOffsetIndex(self):
+		return getStoryIndex(
+			storyOffsetIndexes,
+			self._storyFieldsAndRects[0],
+			lambda fields: StoryOffsetIndex(fields, DANA_HIGHLIGHT_COLOR)
+		)
+
+	def _get__linkIndex(self):
+		return getStoryIndex(
+			linkIndexes,
+			self._storyFieldsAndRects[0],
+			lambda fields: LinkIndex(fields, DANA_LINK_COLOR)
+		)
+
+	def _get__quoteIndex(self):
+		return getStoryIndex(quoteIndexes, self._storyFieldsAndRects[0], QuoteIndex)
+
+	def _getStoryText(self):
+		return self._storyOffsetIndex.storyText
+
+	def _getStoryLength(self):
+		return self._storyOffsetIndex.storyLength
+
+	def _getTextRange(self, start, end):
+		# Only chunks overlapping the range are used, rather than slicing text of the whole story.
+		return self._storyOffsetIndex.getTextRange(start, end)
 
+	@timed("DanaTextInfo._getSelectionOffsets")
 	def _getSelectionOffsets(self):
-		fields = self._storyFieldsAndRects[0]
-		startOffset = None
-		endOffset = None
-		curOffset = 0
-		inHighlightChunk = False
-		for item in fields:
-			if (
-				isinstance(item, textInfos.FieldCommand)
-				and item.command == "formatChange"
-				and item.field.get('color', None) == RGB(red=255, green=255, blue=255)
-			):
-				inHighlightChunk = True
-				if startOffset is None:
-					startOffset = curOffset
-			elif isinstance(item, six.string_types):
-				try:
-					import textUtils
-					curOffset += textUtils.WideStringOffsetConverter(item).wideStringLength
-				except ImportError:
-					curOffset += len(item)
-				if inHighlightChunk:
-					endOffset = curOffset
-			else:
-				inHighlightChunk = False
-		if startOffset is not None and endOffset is not None:
-			return (startOffset, endOffset)
+		selectionOffsets = self._storyOffsetIndex.getSelectionOffsets()
+		if selectionOffsets is not None:
+			return selectionOffsets
 		offset = self._getCaretOffset()
 		return offset, offset
 
@@ -220,9 +2037,8 @@ class DanaEdit(EditableTextWithoutAutoSelectDetection, Window):
 		return self.windowControlID != 103 or api.getForegroundObject().windowClassName == "Becky2MainFrame"
 
 	@staticmethod
-	def _activateURLAtPos(pos):
-		# If user configures Becky! to open links with a single click they're underlined.
-		shouldClickTwice = DanaEdit._TIMatchesCondition(pos, "underline", False)
+	def _activateURLAtPos(pos, shouldClickTwice):
+		import mouseHandler
 		oldMouseCoords = winUser.getCursorPos()
 		winUser.setCursorPos(pos.pointAtStart.x, pos.pointAtStart.y)
 		mouseHandler.executeMouseEvent(winUser.MOUSEEVENTF_LEFTDOWN, 0, 0)
@@ -232,28 +2048,12 @@ class DanaEdit(EditableTextWithoutAutoSelectDetection, Window):
 			mouseHandler.executeMouseEvent(winUser.MOUSEEVENTF_LEFTUP, 0, 0)
 		winUser.setCursorPos(*oldMouseCoords)
 
-	@staticmethod
-	def _TIMatchesCondition(TI, attrName, expectedCondition):
-		for field in TI.getTextWithFields():
-			try:
-				if field.command == "formatChange":
-					return field.field[attrName] == expectedCondition
-			except (AttributeError, KeyError):
-				continue
-		return False
+	def _makeLinkTextInfo(self, link):
+		return self.makeTextInfo(Offsets(link.startOffset, link.endOffset))
 
-	@staticmethod
-	def _isALink(pos):
-		return DanaEdit._TIMatchesCondition(pos, 'color', RGB(red=0, green=0, blue=192))
-
-	def _iterPositionsUntilEOL(self, startPos):
-		eolPos = startPos.copy()
-		eolPos.expand(textInfos.UNIT_LINE)
-		eolPos.collapse(end=True)
-		while startPos.compareEndPoints(eolPos, "startToStart") == -1:
-			startPos.expand(textInfos.UNIT_CHARACTER)
-			yield startPos
-			startPos.move(textInfos.UNIT_CHARACTER, 1)
+	def _activateLink(self, link):
+		# If user configures Becky! to open links with a single click they're underlined.
+		self._activateURLAtPos(self._makeLinkTextInfo(link), not link.underlined)
 
 	@script(
 		gesture="kb:enter"
@@ -261,18 +2061,433 @@ class DanaEdit(EditableTextWithoutAutoSelectDetection, Window):
 	def script_urlActivate(self, gesture):
 		if self.isReadOnly:
 			caretPos = self.makeTextInfo(textInfos.POSITION_CARET)
-			for pos in self._iterPositionsUntilEOL(caretPos):
-				if self._isALink(pos):
-					self._activateURLAtPos(pos)
-					return
-				if pos.text in "> ":
-					continue
-				else:
-					ui.message("Not on a link")
-					return
+			restOfLine = caretPos.copy()
+			restOfLine.expand(textInfos.UNIT_LINE)
+			restOfLine.setEndPoint(caretPos, "startToStart")
+			lineText = restOfLine.text.rstrip("\r\n")
+			# Quote markers and spaces before the link are skipped.
+			skippedChars = len(lineText) - len(lineText.lstrip("> "))
+			if skippedChars == len(lineText):
+				return
+			link = caretPos._linkIndex.getLinkAt(caretPos._startOffset + skippedChars)
+			if link is None:
+				ui.message("Not on a link")
+			else:
+				self._activateLink(link)
 		else:
 			gesture.send()
 
+	def _getReviewPosition(self):
+		"""Returns position of the review cursor if it is in this window, otherwise position of the caret."""
+		reviewPos = api.getReviewPosition()
+		if reviewPos.obj != self or not isinstance(reviewPos, DanaTextInfo):
+			reviewPos = self.makeTextInfo(textInfos.POSITION_CARET)
+		return reviewPos
+
+	def _moveToLink(self, findLink, notFoundMessage):
+		reviewPos = self._getReviewPosition()
+		link = findLink(reviewPos._linkIndex, reviewPos._startOffset)
+		if link is None:
+			ui.message(notFoundMessage)
+			return
+		api.setReviewPosition(self._makeLinkTextInfo(link))
+		ui.message(link.text.strip())
+
+	@script(
+		gesture="kb:NVDA+alt+downArrow",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Moves the review cursor to the next link in the message"
+	)
+	def script_nextLink(self, gesture):
+		self._moveToLink(LinkIndex.getNextLink, "No next link")
+
+	@script(
+		gesture="kb:NVDA+alt+upArrow",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Moves the review cursor to the previous link in the message"
+	)
+	def script_previousLink(self, gesture):
+		self._moveToLink(LinkIndex.getPreviousLink, "No previous link")
+
+	def _moveToQuoteTarget(self, findTarget, notFoundMessage, reportLevel):
+		"""Moves the review cursor to the first line of a quote run or paragraph found in the quote index.
+
+		Targets are looked up in the index, so the caret is never moved line by line through the message.
+		"""
+		reviewPos = self._getReviewPosition()
+		target = findTarget(reviewPos._quoteIndex, reviewPos._startOffset)
+		if target is None:
+			ui.message(notFoundMessage)
+			return
+		lineText = reviewPos._storyOffsetIndex.getTextRange(target.startOffset, target.firstLineEnd).strip()
+		api.setReviewPosition(self.makeTextInfo(Offsets(target.startOffset, target.startOffset)))
+		if reportLevel:
+			# Quote markers are redundant once the level is reported.
+			levelText = "Quote level {}".format(target.depth) if target.depth else "Not quoted"
+			lineText = u"{}, {}".format(levelText, lineText.lstrip(QuoteIndex.QUOTE_PREFIX_CHARS))
+		ui.message(lineText)
+
+	@script(
+		gesture="kb:NVDA+alt+rightArrow",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Moves the review cursor to the next change of quote level in the message"
+	)
+	def script_nextQuoteLevel(self, gesture):
+		self._moveToQuoteTarget(QuoteIndex.getNextRun, "No next change of quote level", True)
+
+	@script(
+		gesture="kb:NVDA+alt+leftArrow",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Moves the review cursor to the previous change of quote level in the message"
+	)
+	def script_previousQuoteLevel(self, gesture):
+		self._moveToQuoteTarget(QuoteIndex.getPreviousRun, "No previous change of quote level", True)
+
+	@script(
+		gesture="kb:NVDA+alt+q",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Moves the review cursor to the first unquoted text after the current quote"
+	)
+	def script_skipQuote(self, gesture):
+		self._moveToQuoteTarget(QuoteIndex.getRunAfterQuote, "No unquoted text after the quote", True)
+
+	@script(
+		gesture="kb:NVDA+alt+pageDown",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Moves the review cursor to the next paragraph in the message"
+	)
+	def script_nextParagraph(self, gesture):
+		self._moveToQuoteTarget(QuoteIndex.getNextParagraph, "No next paragraph", False)
+
+	@script(
+		gesture="kb:NVDA+alt+pageUp",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Moves the review cursor to the previous paragraph in the message"
+	)
+	def script_previousParagraph(self, gesture):
+		self._moveToQuoteTarget(QuoteIndex.getPreviousParagraph, "No previous paragraph", False)
+
+	@script(
+		gesture="kb:NVDA+shift+l",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Shows list of all links in the message, the chosen one is activated"
+	)
+	def script_listLinks(self, gesture):
+		links = self.makeTextInfo(textInfos.POSITION_FIRST)._linkIndex.links
+		if not links:
+			ui.message("No links in the message")
+			return
+
+		import core
+		import gui
+		import wx
+
+		def showDialog():
+			dialog = wx.SingleChoiceDialog(
+				gui.mainFrame,
+				"Links:",
+				"Links in the message",
+				[link.text.strip() for link in links]
+			)
+			gui.mainFrame.prePopup()
+			try:
+				result = dialog.ShowModal()
+				chosenLink = links[dialog.GetSelection()]
+			finally:
+				dialog.Destroy()
+				gui.mainFrame.postPopup()
+			if result == wx.ID_OK:
+				# Give Becky! time to regain focus before clicking.
+				core.callLater(200, self._activateLink, chosenLink)
+
+		wx.CallAfter(showDialog)
+
+
+def readDisplayModelText(obj, rect):
+	"""Returns text drawn in the given rectangle of the window of the object."""
+	text = DisplayModelTextInfo(obj, rect).text
+	if sessionRecorder.isRecording:
+		sessionRecorder.recordScreen(obj.windowHandle, rect, text)
+	return text
+
+
+def readDisplayModelLines(obj, rect):
+	"""Returns lines of text drawn in the given rectangle of the window of the object.
+
+	Every line is a tuple of the top and bottom coordinate of its first visible character,
+	in physical coordinates as locations of objects are, and of its stripped text.
+	Lines containing only whitespace are omitted.
+	"""
+	fields, rects = DisplayModelTextInfo(obj, rect)._storyFieldsAndRects[:2]
+	lines = []
+	lineChars = []
+	lineRect = None
+	offset = 0
+
+	def appendLine():
+		physicalRect = toPhysicalRect(obj.windowHandle, lineRect)
+		lines.append((physicalRect.top, physicalRect.bottom, u"".join(lineChars).strip()))
+
+	for item in fields:
+		if not isinstance(item, STRING_TYPES):
+			continue
+		for char in item:
+			if char == u"\n":
+				if lineRect is not None:
+					appendLine()
+				lineChars = []
+				lineRect = None
+			else:
+				if lineRect is None and not char.isspace() and offset < len(rects):
+					lineRect = rects[offset]
+				lineChars.append(char)
+			offset += wideStringLength(char)
+	if lineRect is not None:
+		appendLine()
+	if sessionRecorder.isRecording:
+		sessionRecorder.recordScreenLines(obj.windowHandle, rect, lines)
+	return lines
+
+
+def getFirstVisibleTreeItem(windowHandle):
+	"""Returns handle of the topmost visible item of the tree view, which changes when it is scrolled."""
+	itemHandle = watchdog.cancellableSendMessage(windowHandle, TVM_GETNEXTITEM, TVGN_FIRSTVISIBLE, 0)
+	if sessionRecorder.isRecording:
+		sessionRecorder.recordFirstVisibleTreeItem(windowHandle, itemHandle)
+	return itemHandle
+
+
+def makeRect(left, top, right, bottom):
+	"""Creates rectangle used by the display model in the given NVDA version."""
+	try:
+		Rect = textInfos.Rect
+	except AttributeError:
+		from locationHelper import RectLTRB as Rect
+	return Rect(left, top, right, bottom)
+
+
+def toPhysicalRect(windowHandle, rect):
+	"""Converts rectangle of the display model, in logical coordinates of the window, to physical coordinates."""
+	try:
+		return rect.toPhysical(windowHandle)
+	except AttributeError:
+		# Older NVDA versions.
+		import windowUtils
+		left, top = windowUtils.logicalToPhysicalPoint(windowHandle, rect.left, rect.top)
+		right, bottom = windowUtils.logicalToPhysicalPoint(windowHandle, rect.right, rect.bottom)
+		return makeRect(left, top, right, bottom)
+
+
+def getScreenRect(location):
+	"""Converts location of an object to the rectangle used by the display model."""
+	left, top, width, height = location
+	return makeRect(left, top, left + width, top + height)
+
+
+class FolderTreeSnapshot(object):
+	"""Unread info of all folders visible in the folder tree, read from its display model at once.
+
+	Becky! draws amount of unread messages after the folder name i.e. `name(count)`,
+	or `name(+)` when only subfolders of a collapsed folder contain unread messages.
+	Every mailbox has folders with the same names, so rows are identified by their position on the screen,
+	which is valid only as long as the tree is not scrolled, i.e. its first visible item is the same.
+	"""
+
+	UNREAD_INFO_RE = re.compile(r"^(.*)\((\d+|\+)\)$")
+
+	Row = collections.namedtuple("Row", ("top", "bottom", "name", "unreadInfo"))
+
+	def __init__(self, lines, firstVisibleItem=None, clock=time.time):
+		super(FolderTreeSnapshot, self).__init__()
+		self._clock = clock
+		self.createdAt = clock()
+		self.firstVisibleItem = firstVisibleItem
+		self.folders = []
+		rows = []
+		for top, bottom, line in lines:
+			match = self.UNREAD_INFO_RE.match(line)
+			name, unreadInfo = match.groups() if match else (line, None)
+			self.folders.append((name, unreadInfo))
+			rows.append(self.Row(top, bottom, name, unreadInfo))
+		self._rows = sorted(rows)
+		self._rowTops = [row.top for row in self._rows]
+
+	@classmethod
+	def fromTreeView(cls, treeView, firstVisibleItem=None, clock=time.time):
+		return cls(readDisplayModelLines(treeView, getScreenRect(treeView.location)), firstVisibleItem, clock)
+
+	@property
+	def isExpired(self):
+		return self._clock() - self.createdAt > FOLDER_TREE_SNAPSHOT_MAX_AGE
+
+	def getUnreadInfo(self, location, name):
+		"""Returns unread info of the folder drawn at the given location, or `None` if it has no unread messages.
+		Raises `LookupError` if no row at this location shows a folder with the given name.
+		"""
+		# Text is drawn inside of the rectangle of the item, lower than its top, as it is vertically centered.
+		rowIndex = bisect.bisect_left(self._rowTops, location.top)
+		if (
+			rowIndex == len(self._rows)
+			or self._rows[rowIndex].top >= location.top + location.height
+			or self._rows[rowIndex].name != name
+		):
+			raise LookupError(name)
+		return self._rows[rowIndex].unreadInfo
+
+	def getTotals(self):
+		"""Returns sum of unread messages in all visible folders, amount of folders containing them,
+		and amount of collapsed folders whose subfolders contain unread messages.
+		"""
+		unreadCounts = [int(unreadInfo) for name, unreadInfo in self.folders if unreadInfo and unreadInfo != "+"]
+		collapsedWithUnread = sum(1 for name, unreadInfo in self.folders if unreadInfo == "+")
+		return sum(unreadCounts), len(unreadCounts), collapsedWithUnread
+
+
+class FolderTreeIndex(SearchableRows):
+	"""Paths of all folders in the folder tree, including those in collapsed branches, indexed for searching.
+
+	The tree is walked with tree view messages rather than with NVDA objects,
+	and names of all walked items are read from Becky! in one batch.
+	Items which fired events are marked as outdated, and on refresh only their subtrees are walked again.
+	"""
+
+	PATH_SEPARATOR = u" / "
+	FETCH_CHUNK_SIZE = 256
+	# Stands for the invisible root of the tree, parent of the top level folders.
+	ROOT = 0
+
+	def __init__(self, windowHandle, sendMessage=None):
+		super(FolderTreeIndex, self).__init__(windowHandle)
+		self._sendMessage = sendMessage or watchdog.cancellableSendMessage
+		self.itemHandles = []
+		self._names = {}
+		self._parents = {}
+		self._children = {}
+		self._outdatedChildIDs = set()
+		self._isOutdated = True
+
+	def markOutdated(self, childID=0):
+		"""Marks subtree of the item with the given IAccessible child ID, or the whole tree for 0, as outdated."""
+		if childID:
+			self._outdatedChildIDs.add(childID)
+		else:
+			self._isOutdated = True
+
+	def _getNextItem(self, flag, itemHandle):
+		return self._sendMessage(self.windowHandle, TVM_GETNEXTITEM, flag, itemHandle)
+
+	def _getOutdatedSubtrees(self):
+		"""Returns handles of the roots of outdated subtrees, none of which is a descendant of another."""
+		if self._isOutdated:
+			return {self.ROOT}
+		subtrees = set()
+		for childID in self._outdatedChildIDs:
+			itemHandle = self._sendMessage(self.windowHandle, TVM_MAPACCIDTOHTREEITEM, childID, 0)
+			if not itemHandle:
+				continue
+			if itemHandle not in self._parents:
+				# Item has been added - walk its parent, or the whole tree if the parent is unknown as well.
+				itemHandle = self._getNextItem(TVGN_PARENT, itemHandle) or self.ROOT
+				if itemHandle != self.ROOT and itemHandle not in self._parents:
+					return {self.ROOT}
+			subtrees.add(itemHandle)
+		if self.ROOT in subtrees:
+			return {self.ROOT}
+		outermostSubtrees = set()
+		for itemHandle in subtrees:
+			ancestor = self._parents[itemHandle]
+			while ancestor != self.ROOT and ancestor not in subtrees:
+				ancestor = self._parents[ancestor]
+			if ancestor == self.ROOT:
+				outermostSubtrees.add(itemHandle)
+		return outermostSubtrees
+
+	def _forgetDescendants(self, itemHandle):
+		for child in self._children.pop(itemHandle, ()):
+			self._forgetDescendants(child)
+			del self._parents[child]
+			self._names.pop(child, None)
+
+	def _walk(self, subtreeRoot):
+		"""Records descendants of the given item, returning their handles."""
+		walkedItems = []
+		pendingParents = [subtreeRoot]
+		while pendingParents:
+			parent = pendingParents.pop()
+			children = self._children[parent] = []
+			if parent == self.ROOT:
+				child = self._getNextItem(TVGN_ROOT, 0)
+			else:
+				child = self._getNextItem(TVGN_CHILD, parent)
+			while child:
+				children.append(child)
+				self._parents[child] = parent
+				walkedItems.append(child)
+				pendingParents.append(child)
+				child = self._getNextItem(TVGN_NEXT, child)
+		return walkedItems
+
+	def _rebuildRows(self):
+		self.itemHandles = []
+		self.rows = []
+		pendingItems = [(child, ()) for child in reversed(self._children.get(self.ROOT, ()))]
+		while pendingItems:
+			itemHandle, parentPath = pendingItems.pop()
+			path = parentPath + (self._names.get(itemHandle, u""),)
+			self.itemHandles.append(itemHandle)
+			self.rows.append((self.PATH_SEPARATOR.join(path),))
+			pendingItems.extend((child, path) for child in reversed(self._children.get(itemHandle, ())))
+		self._rowWords = [set() for row in self.rows]
+		self._wordIndex = {}
+		self._sortedWords = None
+		for itemIndex in range(len(self.rows)):
+			self._indexRow(itemIndex)
+
+	def refresh(self, pool):
+		"""Walks the outdated parts of the tree again, and returns amount of items which were read."""
+		subtrees = self._getOutdatedSubtrees()
+		itemsToRead = []
+		try:
+			for subtreeRoot in subtrees:
+				self._forgetDescendants(subtreeRoot)
+				if subtreeRoot != self.ROOT:
+					# The item itself could be renamed.
+					itemsToRead.append(subtreeRoot)
+				itemsToRead.extend(self._walk(subtreeRoot))
+			for chunkStart in range(0, len(itemsToRead), self.FETCH_CHUNK_SIZE):
+				self._names.update(pool.getTreeItemsTexts(
+					self.windowHandle,
+					itemsToRead[chunkStart:chunkStart + self.FETCH_CHUNK_SIZE]
+				))
+		except Exception:
+			# Parts of the tree could have been forgotten and not walked again, so all of it is outdated.
+			self._isOutdated = True
+			raise
+		# Marks are cleared only once the reads succeeded, so that a failed refresh is retried.
+		self._isOutdated = False
+		self._outdatedChildIDs.clear()
+		if not subtrees:
+			return 0
+		self._rebuildRows()
+		return len(itemsToRead)
+
+
+class FolderSearch(MessageSearch):
+	"""Incremental type-ahead search in the folder tree, jumping to any folder including collapsed ones."""
+
+	def __init__(self, appModule, index, startIndex):
+		super(FolderSearch, self).__init__(appModule, index, None, startIndex)
+
+	def _selectRow(self, itemIndex):
+		# Selecting an item expands all its ancestors, and moves focus to it.
+		watchdog.cancellableSendMessage(
+			self.snapshot.windowHandle,
+			TVM_SELECTITEM,
+			TVGN_CARET,
+			self.snapshot.itemHandles[itemIndex]
+		)
+		self.currentIndex = itemIndex
+
 
 class FolderTreeViewItem(TreeViewItem):
 	""" For the treewiev containing folders.
@@ -291,25 +2506,65 @@ Remove it from those which do not have children.
 			return False
 		return super(FolderTreeViewItem, self)._get_shouldAllowIAccessibleFocusEvent()
 
-	def _get_unreadInfo(self):
-		obj = self
-		while obj and obj.role != CTWRAPPER.Role.TREEVIEW:
-			obj = obj.parent
-		rootTreeViewLocation = obj.location
-		rect = getattr(textInfos, "Rect", locationHelper.RectLTRB)(
+	def event_gainFocus(self):
+		# Remember the selected folder, so that code pages of messages can be guessed per folder.
+		self.appModule.currentFolderName = self.name
+		super(FolderTreeViewItem, self).event_gainFocus()
+
+	def _get_treeView(self):
+		return NVDAObjects.IAccessible.getNVDAObjectFromEvent(self.windowHandle, winUser.OBJID_CLIENT, 0)
+
+	def _readUnreadInfoFromScreen(self, treeView):
+		"""Reads unread info only for this item, used when it cannot be found in the snapshot of the tree."""
+		rect = makeRect(
 			self.location.left,
 			self.location.top,
-			self.location.left + rootTreeViewLocation.width,
+			self.location.left + treeView.location.width,
 			self.location.top + self.location.height
 		)
-		screenContent = DisplayModelTextInfo(obj, rect).text
-		unreadInfoFinder = u"^{}\\((\\d+|\\+)\\)$".format(re.escape(self.name))
-		if re.match(unreadInfoFinder, screenContent):
-			return re.match(unreadInfoFinder, screenContent).group(1)
-		else:
-			if screenContent != self.name:
-				log.error("Failed to get proper displaytext. Got: {}".format(screenContent))
-			return None
+		screenContent = readDisplayModelText(treeView, rect)
+		match = FolderTreeSnapshot.UNREAD_INFO_RE.match(screenContent)
+		if match and match.group(1) == self.name:
+			return match.group(2)
+		if screenContent != self.name:
+			log.error("Failed to get proper displaytext. Got: {}".format(screenContent))
+		return None
+
+	@timed("FolderTreeViewItem.unreadInfo")
+	def _get_unreadInfo(self):
+		unreadInfo = self._readUnreadInfo()
+		if sessionRecorder.isRecording:
+			sessionRecorder.recordUnreadInfo(self, unreadInfo)
+		return unreadInfo
+
+	def _readUnreadInfo(self):
+		name = self.name
+		location = self.location
+		treeView = self.treeView
+		try:
+			return self.appModule.getFolderTreeSnapshot(treeView).getUnreadInfo(location, name)
+		except LookupError:
+			# Folder was not drawn there when the snapshot was made, perhaps it has been renamed since.
+			pass
+		try:
+			return self.appModule.getFolderTreeSnapshot(treeView, refresh=True).getUnreadInfo(location, name)
+		except LookupError:
+			return self._readUnreadInfoFromScreen(treeView)
+
+	@script(
+		gesture="kb:NVDA+shift+f",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Starts type-ahead search of folders, including those in collapsed branches of the folder tree"
+	)
+	def script_searchFolders(self, gesture):
+		index = self.appModule.getFolderTreeIndex(self.windowHandle)
+		index.refresh(self.appModule.getRemoteBufferPool())
+		try:
+			startIndex = index.itemHandles.index(self.treeview_hItem)
+		except ValueError:
+			startIndex = 0
+		self.appModule.startMessageSearch(FolderSearch(self.appModule, index, startIndex))
+		ui.message("Search {} folders".format(len(index.rows)))
 
 	def _get_description(self):
 		unreadInfo = self.unreadInfo
@@ -321,35 +2576,82 @@ Remove it from those which do not have children.
 		return None
 
 
+class MessagesContextMenuSnapshot(object):
+	"""Names, keyboard shortcuts and checked states of all items of the menu listing messages,
+	read once when the menu is opened.
+	"""
+
+	Item = collections.namedtuple("Item", ("name", "keyboardShortcut", "checked"))
+
+	def __init__(self, items):
+		super(MessagesContextMenuSnapshot, self).__init__()
+		self.items = items
+
+	@classmethod
+	def readItem(cls, accessible, childID):
+		"""Reads one item, given by its child ID, from the IAccessible of the menu."""
+		name = accessible.accName(childID) or ""
+		keyboardShortcut = accessible.accKeyboardShortcut(childID) or ""
+		# Shortcut of each menu item is replicated in the name.
+		# Even though it would be easier to just get rid of the shortcut, this approach is more correct.
+		name = name.lstrip("{}: ".format(keyboardShortcut.upper()))
+		checked = bool(accessible.accState(childID) & oleacc.STATE_SYSTEM_CHECKED)
+		return cls.Item(name, keyboardShortcut, checked)
+
+	@classmethod
+	def fromMenu(cls, menu):
+		accessible = menu.IAccessibleObject
+		return cls([cls.readItem(accessible, childID) for childID in range(1, accessible.accChildCount + 1)])
+
+	def getItem(self, childID):
+		"""Returns the item with the given child ID, or `None` if the menu had no such item when it was opened."""
+		if 1 <= childID <= len(self.items):
+			return self.items[childID - 1]
+		return None
+
+
 class messagesContextMenu(MenuItem):
 
-	def _get_name(self):
-		""" Shortcut of each menu item is replicated in the name.
-		Even though it would be easier to just get rid of the shortcut, this approach is more correct.
+	# Snapshot of the whole menu, verified and set on the object when this overlay class is chosen.
+	messagesContextMenuSnapshot = None
+
+	_cache__snapshotItem = True
+
+	def _get__snapshotItem(self):
+		"""Properties of this item are served from the snapshot of the whole menu,
+		reading only this item if it is missing in the snapshot.
 		"""
-		name = super(messagesContextMenu, self)._get_name()
-		hotKey = super(messagesContextMenu, self)._get_keyboardShortcut()
-		return name.lstrip("{}: ".format(hotKey.upper()))
+		snapshot = self.messagesContextMenuSnapshot
+		item = snapshot.getItem(self.IAccessibleChildID) if snapshot is not None else None
+		if item is None:
+			item = MessagesContextMenuSnapshot.readItem(self.IAccessibleObject, self.IAccessibleChildID)
+		return item
+
+	def _get_name(self):
+		return self._snapshotItem.name
+
+	def _get_keyboardShortcut(self):
+		return self._snapshotItem.keyboardShortcut
 
 	def _get_states(self):
 		""" If message is received in current account it has always a checked state.
-		Discard it here and take care of it when creating a description.
+		Discard it here, the description takes care of it using the checked state from the snapshot.
+		States are otherwise read live, as focus moves between items while the menu is open.
 		"""
 		states = super(messagesContextMenu, self)._get_states()
-		if CTWRAPPER.State.CHECKED in states:
-			states.remove(CTWRAPPER.State.CHECKED)
+		states.discard(CTWRAPPER.State.CHECKED)
 		return states
 
 	def _get_description(self):
-		states = MenuItem._get_states(self)
-		if CTWRAPPER.State.CHECKED in states or self.IAccessibleChildID == 1:
+		if self._snapshotItem.checked or self.IAccessibleChildID == 1:
 			return None
 		else:
 			return "From other account"
 
 	def _get_positionInfo(self):
 		currentPos = self.IAccessibleChildID
-		total = self.parent.childCount
+		snapshot = self.messagesContextMenuSnapshot
+		total = len(snapshot.items) if snapshot is not None else self.parent.childCount
 		if currentPos > 1:
 			currentPos -= 1
 		return dict(indexInGroup=currentPos, similarItemsInGroup=total - 1)
@@ -360,6 +2662,7 @@ class messagesContextMenu(MenuItem):
 	def script_deleteItem(self, gesture):
 		if self.IAccessibleChildID == 1:
 			return
+		import mouseHandler
 		(left, top, width, height) = self.location
 		oldMouseCoords = winUser.getCursorPos()
 		x = left + (width // 2)
@@ -368,6 +2671,8 @@ class messagesContextMenu(MenuItem):
 		mouseHandler.executeMouseEvent(winUser.MOUSEEVENTF_RIGHTDOWN, 0, 0)
 		mouseHandler.executeMouseEvent(winUser.MOUSEEVENTF_RIGHTUP, 0, 0)
 		winUser.setCursorPos(*oldMouseCoords)
+		# Menu stays open, but child IDs of the items after the deleted one are shifted.
+		self.appModule.dropMessagesContextMenuSnapshot(self.windowHandle)
 
 
 class Message(ListItem):
@@ -390,10 +2695,13 @@ class Message(ListItem):
 	and try to guess the code page based on the part of the text exposed via DisplayModel.
 	"""
 
-	POSSIBLE_ENCODINGS = ("utf8", locale.getpreferredencoding(), "1251", "shift_jis", "gb18030", "cp949")
+	@lazyClassAttribute
+	def POSSIBLE_ENCODINGS():
+		# Code page for non-Unicode programs is retrieved on first use, not when the module is loaded.
+		return ("utf8", locale.getpreferredencoding(), "1251", "shift_jis", "gb18030", "cp949")
 
-	def _getColumnBytes(self, index):
-		"""Retrieves actual content of the given column as bytes.
+	def _getColumnsBytes(self, indexes):
+		"""Retrieves actual content of the given columns as bytes.
 
 		When retrieving content of a given column, NVDA gets the data which is already decoded by Windows.
 		In case of Becky!'s list view it is decoded using current code page for non-Unicode programs,
@@ -401,49 +2709,91 @@ class Message(ListItem):
 		Sadly after this decoding content is irretrievably damaged.
 		We follow a similar logic to the one used in NVDA by default,
 		but retrieve the content before it is being decoded i.e. as raw bytes.
+		All requested columns are fetched in one batch using memory shared by the entire app module.
 		"""
-		buffer = None
-		processHandle = self.processHandle
-		internalItem = winKernel.virtualAllocEx(
-			processHandle,
-			None,
-			sizeof(self.LVITEM),
-			winKernel.MEM_COMMIT,
-			winKernel.PAGE_READWRITE
+		return self.appModule.getRemoteBufferPool().getItemTexts(
+			self.windowHandle,
+			self.LVITEM,
+			self.IAccessibleChildID - 1,
+			indexes
 		)
+
+	_cache_rowColumnsBytes = True
+
+	def _get_rowColumnsBytes(self):
+		"""Content of all columns of this row as bytes, fetched in one batch unless it has been prefetched.
+
+		Fetching is done on a worker thread, so that a list which does not respond cannot block NVDA.
+		If the content is not available in `COLUMN_FETCH_TIMEOUT` seconds `None` is returned,
+		and the message is announced again once it has been fetched.
+		"""
+		futures = self._submitRowFetch()
+		deadline = time.time() + COLUMN_FETCH_TIMEOUT
 		try:
-			internalText = winKernel.virtualAllocEx(
-				processHandle,
-				None,
-				CBEMAXSTRLEN * 2,
-				winKernel.MEM_COMMIT,
-				winKernel.PAGE_READWRITE
+			return dict(
+				(column, future.result(max(deadline - time.time(), 0)))
+				for column, future in futures.items()
 			)
-			try:
-				item = self.LVITEM(
-					iItem=self.IAccessibleChildID - 1,
-					mask=LVIF_TEXT | LVIF_COLUMNS,
-					iSubItem=index,
-					pszText=internalText,
-					cchTextMax=CBEMAXSTRLEN
-				)
-				winKernel.writeProcessMemory(processHandle, internalItem, byref(item), sizeof(self.LVITEM), None)
-				len = watchdog.cancellableSendMessage(
-					self.windowHandle,
-					LVM_GETITEMTEXTA,
-					(self.IAccessibleChildID - 1),
-					internalItem
-				)
-				if len:
-					winKernel.readProcessMemory(processHandle, internalItem, byref(item), sizeof(self.LVITEM), None)
-					buffer = create_string_buffer(len)
-					winKernel.readProcessMemory(processHandle, item.pszText, buffer, sizeof(buffer), None)
-			finally:
-				winKernel.virtualFreeEx(processHandle, internalText, 0, winKernel.MEM_RELEASE)
-		finally:
-			winKernel.virtualFreeEx(processHandle, internalItem, 0, winKernel.MEM_RELEASE)
-		return buffer
+		except ColumnFetchTimeout:
+			self._announceWhenFetched(futures)
+		except ColumnFetchCancelled:
+			pass
+		return None
+
+	def _submitRowFetch(self):
+		return self.appModule.getColumnFetcher(self.LVITEM).submitRow(
+			self.windowHandle,
+			self.IAccessibleChildID - 1,
+			range(self.parent.columnCount)
+		)
+
+	def _announceWhenFetched(self, futures):
+		pendingFutures = set(futures.values())
+		lock = threading.Lock()
+
+		def onDone(future):
+			with lock:
+				pendingFutures.discard(future)
+				if pendingFutures:
+					return
+			import queueHandler
+			if not any(future.failed() for future in futures.values()):
+				queueHandler.queueFunction(queueHandler.eventQueue, self._announceFetchedContent)
+			elif any(future.cancelled() for future in futures.values()):
+				# Dropped because the list changed while waiting, the placeholder still has to be replaced.
+				queueHandler.queueFunction(queueHandler.eventQueue, self._fetchAgainIfFocused)
+
+		for future in list(futures.values()):
+			future.addDoneCallback(onDone)
+
+	def _announceFetchedContent(self):
+		if api.getFocusObject() == self:
+			ui.message(self.name)
+
+	def _fetchAgainIfFocused(self):
+		if api.getFocusObject() == self:
+			self._announceWhenFetched(self._submitRowFetch())
+
+	_cache_rowKey = True
+
+	def _get_rowKey(self):
+		return makeRowKey(self.windowHandle, self.IAccessibleChildID - 1, self.rowColumnsBytes)
 
+	def _get_encodingStatisticsKey(self):
+		"""Encoding statistics are gathered per list window and per the folder selected in the folder tree."""
+		return (self.windowHandle, getattr(self.appModule, "currentFolderName", None))
+
+	@timed("Message._getColumnBytes")
+	def _getColumnBytes(self, index):
+		"""Retrieves actual content of the given column as bytes, or `None` if it is empty."""
+		rowColumnsBytes = self.rowColumnsBytes
+		if rowColumnsBytes is None:
+			return None
+		if index in rowColumnsBytes:
+			return rowColumnsBytes[index]
+		return self._getColumnsBytes((index,))[index]
+
+	@timed("Message._getDecodedColContentFromDisplayModel")
 	def _getDecodedColContentFromDisplayModel(self, colData, colIndex):
 		"""Tries to guess code page of the given list item based on the text visible on the screen.
 
@@ -451,11 +2801,7 @@ class Message(ListItem):
 		it will not work when characters outside ASCII range don't fit on the screen,
 		in that case we cannot verify if whatever we got after decoding matches the custom drawn content.
 		"""
-		left, top, width, height = self._getColumnLocationRaw(colIndex)
-		displayedColContent = DisplayModelTextInfo(
-			self,
-			getattr(textInfos, "Rect", locationHelper.RectLTRB)(left, top, left + width, top + height)
-		).text
+		displayedColContent = readDisplayModelText(self, getScreenRect(self._getColumnLocationRaw(colIndex)))
 		COL_INCOMPLETE_END = "..."
 		if u'\uffff' in displayedColContent:
 			# Column contains character which cannot be represented in the current font,
@@ -472,7 +2818,11 @@ class Message(ListItem):
 				or not displayedColContent[-1]
 			):
 				displayedColContent = displayedColContent[:-1]
-		for encoding in self.POSSIBLE_ENCODINGS:
+		# Only text outside of ASCII tells code pages apart,
+		# a code page which has not been compared with it is not remembered, as that would make it trusted.
+		isVerified = compareWithDisplayed and any(ch >= u"\x80" for word in displayedColContent for ch in word)
+		statisticsKey = self.encodingStatisticsKey
+		for encoding in encodingStatistics.orderEncodings(statisticsKey, self.POSSIBLE_ENCODINGS):
 			try:
 				log.debug("Trying with code page: {} and data is: {}".format(encoding, colData))
 				decodedColContent = colData.decode(encoding)
@@ -480,6 +2830,9 @@ class Message(ListItem):
 					programaticContent = decodedColContent.split(" ")[:len(displayedColContent)]
 					if programaticContent != displayedColContent:
 						continue
+				if isVerified:
+					rowEncodingMemo.put(self.rowKey, encoding)
+					encodingStatistics.recordSuccess(statisticsKey, encoding)
 				return decodedColContent
 			except UnicodeDecodeError:
 				continue
@@ -489,54 +2842,561 @@ class Message(ListItem):
 			return colData.decode("unicode_escape")
 
 	def _getColumnContentRaw(self, index):
-		colContent = self._getColumnBytes(index)
-		if not colContent:
+		colContent = self._readColumnContent(index)
+		if sessionRecorder.isRecording and self.rowColumnsBytes is not None:
+			sessionRecorder.recordColumn(self, index, colContent)
+		return colContent
+
+	def _readColumnContent(self, index):
+		if self.rowColumnsBytes is None:
+			# Content is still being fetched in the background.
+			return PENDING_COLUMN_PLACEHOLDER if index == 0 else None
+		colContentBytes = self._getColumnBytes(index)
+		if not colContentBytes:
 			return None
-		colContentBytes = colContent.value
-		try:
-			allCharsInASCIIRange = all(ch < 129 for ch in map(ord, colContentBytes))  # Python 2
-		except TypeError:
-			allCharsInASCIIRange = all(ch < 129 for ch in colContentBytes)  # Python 3
-		if allCharsInASCIIRange:
-			return colContentBytes.decode("ascii")
+		cacheKey = (colContentBytes, index)
+		colContent = decodedColumnsCache.get(cacheKey)
+		if colContent is None:
+			colContent = self._decodeColumnBytes(colContentBytes, index)
+			decodedColumnsCache.put(cacheKey, colContent)
+		return colContent
+
+	def _decodeColumnBytes(self, colContentBytes, index):
+		colContent = decodeColumnBytesWithoutScreen(
+			colContentBytes,
+			self.rowKey,
+			self.encodingStatisticsKey,
+			self.POSSIBLE_ENCODINGS
+		)
+		if colContent is not None:
+			return colContent
+		# Not sure which code page is the right one - verify candidates against the screen.
 		return self._getDecodedColContentFromDisplayModel(colContentBytes, index)
 
+	@script(
+		gesture="kb:NVDA+shift+f",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Starts type-ahead search of messages in the current folder"
+	)
+	def script_searchMessages(self, gesture):
+		snapshot = self.appModule.getMessageListSnapshot(self.windowHandle)
+		snapshot.refresh(
+			self.appModule.getRemoteBufferPool(),
+			self.LVITEM,
+			self.parent.columnCount,
+			self.encodingStatisticsKey,
+			self.POSSIBLE_ENCODINGS
+		)
+		self.appModule.startMessageSearch(MessageSearch(
+			self.appModule,
+			snapshot,
+			self.LVITEM,
+			self.IAccessibleChildID - 1
+		))
+		ui.message("Search {} messages".format(len(snapshot.rows)))
+
+	def event_gainFocus(self):
+		super(Message, self).event_gainFocus()
+		self.appModule.prefetchRowsAround(
+			self.windowHandle,
+			self.LVITEM,
+			self.IAccessibleChildID - 1,
+			self.parent.columnCount,
+			self.encodingStatisticsKey,
+			self.POSSIBLE_ENCODINGS
+		)
+
+
+class UpdateBurstCoalescer(object):
+	"""Collects objects which fired update events, one per window,
+	and calls `onBurstEnd` with them once no event has been fired for `delay` seconds.
+	"""
+
+	def __init__(self, onBurstEnd, delay=UPDATE_BURST_DELAY, callLater=None, clock=time.time):
+		super(UpdateBurstCoalescer, self).__init__()
+		self._onBurstEnd = onBurstEnd
+		self.delay = delay
+		self._callLater = callLater
+		self._clock = clock
+		self.pendingObjects = {}
+		self._lastEventTime = 0
+		self._isScheduled = False
+
+	def addEvent(self, obj):
+		self.pendingObjects[obj.windowHandle] = obj
+		self._lastEventTime = self._clock()
+		if not self._isScheduled:
+			self._isScheduled = True
+			self._schedule(self.delay)
+
+	def _schedule(self, delay):
+		callLater = self._callLater
+		if callLater is None:
+			import core
+			callLater = core.callLater
+		# Rounded up, so that the end of the burst is never checked too early.
+		callLater(int(math.ceil(delay * 1000)), self._checkBurstEnd)
+
+	def _checkBurstEnd(self):
+		remaining = self._lastEventTime + self.delay - self._clock()
+		if remaining > 0:
+			self._schedule(remaining)
+		else:
+			self.flush()
+
+	def flush(self):
+		"""Ends the current burst immediately."""
+		self._isScheduled = False
+		pendingObjects = self.pendingObjects
+		if not pendingObjects:
+			return
+		self.pendingObjects = {}
+		self._onBurstEnd(list(pendingObjects.values()))
+
 
 class AppModule(appModuleHandler.AppModule):
 
-	def chooseNVDAObjectOverlayClasses(self, obj, clsList):
-		if obj.windowClassName == 'DanaEditWindowClass' and obj.IAccessibleRole == oleacc.ROLE_SYSTEM_CLIENT:
+	def __init__(self, *args, **kwargs):
+		super(AppModule, self).__init__(*args, **kwargs)
+		self.currentFolderName = None
+		self._remoteBufferPool = None
+		self._columnFetcher = None
+		self._prefetchedItemCounts = {}
+		self._remoteBufferPoolLock = threading.Lock()
+		self._messageListSnapshots = {}
+		self._folderTreeSnapshots = {}
+		self._folderTreeIndexes = {}
+		self._focusWasInFolderTree = False
+		self._statusBarReaders = {}
+		self._attachmentsListHandles = {}
+		self._folderTreeHandles = {}
+		self._messagesContextMenuWindows = {}
+		self.announceNewMessages = False
+		self._messageSearch = None
+		# Replaced when a recorded session is replayed, so that caches expire as they did during recording.
+		self.clock = time.time
+		self._updateBurst = UpdateBurstCoalescer(self._handleUpdateBurstEnd, clock=lambda: self.clock())
+
+	def getRemoteBufferPool(self):
+		"""Returns memory pool used for reading list view content, creating it on first use."""
+		with self._remoteBufferPoolLock:
+			if self._remoteBufferPool is None:
+				self._remoteBufferPool = RemoteBufferPool(self.processHandle)
+			return self._remoteBufferPool
+
+	def getColumnFetcher(self, LVITEM):
+		"""Returns object fetching content of messages on worker threads, creating it on first use."""
+		pool = self.getRemoteBufferPool()
+		with self._remoteBufferPoolLock:
+			if self._columnFetcher is None:
+				self._columnFetcher = ColumnFetcher(
+					lambda windowHandle, itemIndex, columns: pool.getItemTexts(windowHandle, LVITEM, itemIndex, columns)
+				)
+			return self._columnFetcher
+
+	def prefetchRowsAround(self, windowHandle, LVITEM, itemIndex, columnCount, statisticsKey, encodings):
+		"""Requests rows around the focused message from the column fetcher with low priority.
+
+		Raw content of the rows is kept by the fetcher, so that when focus moves to one of them
+		no cross-process calls are needed, and decoded columns are put in the `decodedColumnsCache`.
+		Columns which cannot be decoded without looking at the screen are left for the main thread.
+		"""
+		itemCount = watchdog.cancellableSendMessage(windowHandle, LVM_GETITEMCOUNT, 0, 0)
+		columnFetcher = self.getColumnFetcher(LVITEM)
+		knownItemCount = self._prefetchedItemCounts.get(windowHandle)
+		self._prefetchedItemCounts[windowHandle] = itemCount
+		if knownItemCount is not None and knownItemCount != itemCount:
+			# Messages were added or removed - indexes of the fetched rows are no longer valid.
+			columnFetcher.invalidate()
+
+		def decodeRow(windowHandle, itemIndex, row):
+			rowKey = makeRowKey(windowHandle, itemIndex, row)
+			for colIndex, data in row.items():
+				if not data or (data, colIndex) in decodedColumnsCache:
+					continue
+				text = decodeColumnBytesWithoutScreen(data, rowKey, statisticsKey, encodings)
+				if text is not None:
+					decodedColumnsCache.put((data, colIndex), text)
+
+		indexesToFetch = []
+		for distance in range(1, ROWS_TO_PREFETCH + 1):
+			for index in (itemIndex + distance, itemIndex - distance):
+				if 0 <= index < itemCount:
+					indexesToFetch.append(index)
+		columnFetcher.prefetchRows(windowHandle, indexesToFetch, range(columnCount), decodeRow)
+
+	def getMessageListSnapshot(self, windowHandle):
+		try:
+			return self._messageListSnapshots[windowHandle]
+		except KeyError:
+			snapshot = self._messageListSnapshots[windowHandle] = MessageListSnapshot(windowHandle)
+			return snapshot
+
+	def getFolderTreeSnapshot(self, treeView, refresh=False):
+		"""Returns unread info of the visible folders,
+		reading it from the screen if it is outdated or the tree has been scrolled.
+		"""
+		snapshot = self._folderTreeSnapshots.get(treeView.windowHandle)
+		firstVisibleItem = getFirstVisibleTreeItem(treeView.windowHandle)
+		if refresh or snapshot is None or snapshot.isExpired or snapshot.firstVisibleItem != firstVisibleItem:
+			snapshot = self._folderTreeSnapshots[treeView.windowHandle] = FolderTreeSnapshot.fromTreeView(
+				treeView,
+				firstVisibleItem,
+				self.clock
+			)
+		return snapshot
+
+	def getFolderTreeIndex(self, windowHandle):
+		try:
+			return self._folderTreeIndexes[windowHandle]
+		except KeyError:
+			index = self._folderTreeIndexes[windowHandle] = FolderTreeIndex(windowHandle)
+			return index
+
+	def getStatusBarReader(self, mainWindowHandle):
+		try:
+			return self._statusBarReaders[mainWindowHandle]
+		except KeyError:
+			reader = self._statusBarReaders[mainWindowHandle] = StatusBarReader(mainWindowHandle)
+			return reader
+
+	def getAttachmentsListHandle(self, composeWindowHandle):
+		"""Returns handle of the attachments list of the given composer,
+		which is searched for only once for every composer window.
+		Raises `LookupError` if the list is not visible.
+		"""
+		attachmentsListHandle = self._attachmentsListHandles.get(composeWindowHandle)
+		if attachmentsListHandle is None or not winUser.isWindow(attachmentsListHandle):
+			import windowUtils
+			attachmentsListHandle = windowUtils.findDescendantWindow(
+				composeWindowHandle, visible=True, className="SysListView32", controlID=1002
+			)
+			self._attachmentsListHandles[composeWindowHandle] = attachmentsListHandle
+		elif not winUser.isWindowVisible(attachmentsListHandle):
+			raise LookupError("Attachments list is not visible")
+		return attachmentsListHandle
+
+	def getFolderTreeHandle(self, mainWindowHandle):
+		"""Returns handle of the folder tree of the given main window, raises `LookupError` if it is not visible."""
+		folderTreeHandle = self._folderTreeHandles.get(mainWindowHandle)
+		if folderTreeHandle is None or not winUser.isWindow(folderTreeHandle):
+			import windowUtils
+			folderTreeHandle = windowUtils.findDescendantWindow(
+				mainWindowHandle, visible=True, className="SysTreeView32", controlID=1000
+			)
+			self._folderTreeHandles[mainWindowHandle] = folderTreeHandle
+		elif not winUser.isWindowVisible(folderTreeHandle):
+			raise LookupError("Folder tree is not visible")
+		return folderTreeHandle
+
+	def _getListedFolder(self, mainWindowHandle):
+		"""Identifies folder whose messages are listed in the given main window.
+
+		Folders can be changed without focusing the folder tree, for example with shortcuts of the message list,
+		so the selected item of the tree is used together with the name of the last focused folder.
+		"""
+		try:
+			selectedItem = watchdog.cancellableSendMessage(
+				self.getFolderTreeHandle(mainWindowHandle), TVM_GETNEXTITEM, TVGN_CARET, 0
+			)
+		except LookupError:
+			selectedItem = None
+		return (self.currentFolderName, selectedItem)
+
+	def _handleStatusBarNameChange(self, obj):
+		mainWindowHandle = winUser.getAncestor(obj.windowHandle, winUser.GA_ROOT)
+		reader = self.getStatusBarReader(mainWindowHandle)
+		previousCounts = reader.handleNameChange(obj, self._getListedFolder(mainWindowHandle))
+		if not self.announceNewMessages or previousCounts is None:
+			return
+		unread, total = reader.latestCounts
+		if total > previousCounts[1]:
+			ui.message("{} new messages, {} unread".format(total - previousCounts[1], unread))
+
+	def startMessageSearch(self, messageSearch):
+		self._messageSearch = messageSearch
+
+	def endMessageSearch(self):
+		self._messageSearch = None
+
+	def getScript(self, gesture):
+		if self._messageSearch is not None:
+			searchScript = self._messageSearch.getScript(gesture)
+			if searchScript is not None:
+				return searchScript
+		return super(AppModule, self).getScript(gesture)
+
+	@script(
+		gesture="kb:NVDA+control+shift+t",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Toggles measuring how long the add-on takes to read messages, folders and the message viewer"
+	)
+	def script_toggleTiming(self, gesture):
+		timingStatistics.enabled = not timingStatistics.enabled
+		if timingStatistics.enabled:
+			timingStatistics.clear()
+			ui.message("Timing enabled")
+		else:
+			ui.message("Timing disabled")
+
+	@script(
+		gesture="kb:NVDA+control+shift+r",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Reports and logs how long the add-on took to read messages, folders and the message viewer"
+	)
+	def script_reportTiming(self, gesture):
+		summary = timingStatistics.summary()
+		if not summary:
+			ui.message("No timings recorded" if timingStatistics.enabled else "Timing is disabled")
+			return
+		lines = [
+			"{}: {} calls, median {:.2f} ms, 90th {:.2f} ms, 99th {:.2f} ms, max {:.2f} ms".format(
+				path, callsCount, median * 1000, p90 * 1000, p99 * 1000, maximum * 1000
+			)
+			for path, callsCount, median, p90, p99, maximum in summary
+		]
+		log.info("Becky add-on timings:\n{}".format("\n".join(lines)))
+		ui.message("; ".join(lines))
+
+	@script(
+		gesture="kb:NVDA+control+shift+e",
+		category=BECKY_SCRIPT_CATEGORY,
+		description="Starts or stops recording what the add-on reads from Becky!, so that it can be replayed"
+	)
+	def script_toggleSessionRecording(self, gesture):
+		if sessionRecorder.isRecording:
+			path = sessionRecorder.stop()
+			log.info("Becky session recorded to {}".format(path))
+			ui.message("Session saved to {}".format(path))
+			return
+		import os
+		import tempfile
+		path = os.path.join(
+			tempfile.gettempdir(),
+			"beckySession-{}.jsonl.gz".format(time.strftime("%Y%m%d-%H%M%S"))
+		)
+		try:
+			sessionRecorder.start(path)
+		except (IOError, OSError):
+			log.error("Cannot create session recording", exc_info=True)
+			ui.message("Cannot create session recording")
+			return
+		# Reads served from caches would be missing in the recording.
+		self._dropCachedReads()
+		ui.message("Recording session")
+
+	def _invalidatePrefetchedRows(self):
+		if self._columnFetcher is not None:
+			self._columnFetcher.invalidate()
+
+	def _dropCachedReads(self):
+		"""Forgets everything read from Becky! and learned from it, so that it is read again when needed."""
+		decodedColumnsCache.clear()
+		rowEncodingMemo.clear()
+		encodingStatistics.clear()
+		self._invalidatePrefetchedRows()
+		self._messageListSnapshots.clear()
+		self._folderTreeSnapshots.clear()
+		self._folderTreeIndexes.clear()
+
+	@staticmethod
+	def _isMessageList(obj):
+		return obj.windowClassName == 'SysListView32' and obj.windowControlID in MESSAGE_LIST_CONTROL_IDS
+
+	@staticmethod
+	def _isFolderTree(obj):
+		return obj.windowClassName == 'SysTreeView32' and obj.windowControlID == 1000
+
+	def _invalidateCachesOf(self, obj):
+		if self._isMessageList(obj):
+			self._invalidatePrefetchedRows()
+		elif self._isFolderTree(obj):
+			self._folderTreeSnapshots.pop(obj.windowHandle, None)
+
+	def _deferUpdateEvent(self, obj):
+		"""Holds back update events of the message list and the folder tree while they are fired in bursts.
+
+		Events of the focused object, and the first event of a burst in a window, are processed immediately.
+		Following events of other objects in the window are dropped until the burst ends,
+		and caches of the window are invalidated once, when it is over.
+		Returns `True` if the event has been held back and should not be processed.
+		"""
+		if not (self._isMessageList(obj) or self._isFolderTree(obj)):
+			return False
+		# Indexes used for searching only mark what changed, it is read again when they are used.
+		folderTreeIndex = self._folderTreeIndexes.get(obj.windowHandle)
+		if folderTreeIndex is not None:
+			folderTreeIndex.markOutdated(obj.IAccessibleChildID)
+		messageListSnapshot = self._messageListSnapshots.get(obj.windowHandle)
+		if messageListSnapshot is not None:
+			messageListSnapshot.markOutdated(obj.IAccessibleChildID)
+		if obj == api.getFocusObject():
+			# Changes of the focused object are announced without delay, so it has to be read again right away.
+			self._invalidateCachesOf(obj)
+			return False
+		isInBurst = obj.windowHandle in self._updateBurst.pendingObjects
+		self._updateBurst.addEvent(obj)
+		return isInBurst
+
+	def _handleUpdateBurstEnd(self, objects):
+		"""Invalidates caches once per window updated during the burst."""
+		for obj in objects:
+			self._invalidateCachesOf(obj)
+
+	def event_appModule_loseFocus(self):
+		# Events of Becky!'s windows are not received while it is in the background.
+		for snapshot in self._messageListSnapshots.values():
+			snapshot.markOutdated()
+
+	def event_gainFocus(self, obj, nextHandler):
+		if sessionRecorder.isRecording:
+			sessionRecorder.recordEvent("gainFocus", obj)
+		# Caches have to be up to date before the new focus is read.
+		self._updateBurst.flush()
+		if self._columnFetcher is not None:
+			# Content of the previously focused message is no longer needed.
+			self._columnFetcher.dropStale(
+				(obj.windowHandle, obj.IAccessibleChildID - 1) if isinstance(obj, Message) else None
+			)
+		if not isinstance(obj, Message):
+			# Focus left the message list - rows could change without us being notified.
+			self._invalidatePrefetchedRows()
+		if self._messageSearch is not None and obj.windowHandle != self._messageSearch.snapshot.windowHandle:
+			self.endMessageSearch()
+		if obj.windowClassName != "#32768":
+			# All menus have been closed.
+			self._messagesContextMenuWindows.clear()
+		if isinstance(obj, DanaEdit):
+			# Another message could be shown since the viewer was last focused.
+			storyFieldsCache.drop(obj.windowHandle)
+		isInFolderTree = isinstance(obj, FolderTreeViewItem)
+		if isInFolderTree and not self._focusWasInFolderTree:
+			# Amounts of unread messages could change while focus was outside of the folder tree.
+			self._folderTreeSnapshots.pop(obj.windowHandle, None)
+		self._focusWasInFolderTree = isInFolderTree
+		nextHandler()
+
+	def event_nameChange(self, obj, nextHandler):
+		if sessionRecorder.isRecording:
+			sessionRecorder.recordEvent("nameChange", obj)
+		if obj.windowClassName == "msctls_statusbar32":
+			self._handleStatusBarNameChange(obj)
+		elif obj.windowClassName == "#32768":
+			self.dropMessagesContextMenuSnapshot(obj.windowHandle)
+		elif self._deferUpdateEvent(obj):
+			return
+		nextHandler()
+
+	def event_stateChange(self, obj, nextHandler):
+		if sessionRecorder.isRecording:
+			sessionRecorder.recordEvent("stateChange", obj)
+		if not self._deferUpdateEvent(obj):
+			nextHandler()
+
+	def event_caret(self, obj, nextHandler):
+		if isinstance(obj, DanaEdit):
+			storyFieldsCache.drop(obj.windowHandle)
+		nextHandler()
+
+	def event_textChange(self, obj, nextHandler):
+		if isinstance(obj, DanaEdit):
+			storyFieldsCache.drop(obj.windowHandle)
+		nextHandler()
+
+	def event_reorder(self, obj, nextHandler):
+		if sessionRecorder.isRecording:
+			sessionRecorder.recordEvent("reorder", obj)
+		if obj.windowClassName == "#32768":
+			self.dropMessagesContextMenuSnapshot(obj.windowHandle)
+		if not self._deferUpdateEvent(obj):
+			nextHandler()
+
+	def terminate(self):
+		if sessionRecorder.isRecording:
+			sessionRecorder.stop()
+		with self._remoteBufferPoolLock:
+			if self._columnFetcher is not None:
+				self._columnFetcher.stop()
+				self._columnFetcher = None
+			if self._remoteBufferPool is not None:
+				self._remoteBufferPool.release()
+				self._remoteBufferPool = None
+		super(AppModule, self).terminate()
+
+	def getMessagesContextMenuSnapshot(self, menuItem):
+		"""Returns snapshot of the menu listing messages the given item belongs to, or `None` for other menus.
+
+		Both the result of the check and the snapshot are remembered for the window of the menu.
+		Windows of popup menus are reused for different menus, and we are not notified when they are opened,
+		so what is remembered is used only as long as the first item and amount of items of the menu are the same,
+		which is much cheaper to verify than reading the text of the menu from the screen.
+		"""
+		menuWindowHandle = menuItem.windowHandle
+		accessible = menuItem.IAccessibleObject
+		menuSignature = (accessible.accName(1), accessible.accChildCount)
+		remembered = self._messagesContextMenuWindows.get(menuWindowHandle)
+		if remembered is not None and remembered[0] == menuSignature:
+			return remembered[1]
+		menu = menuItem.parent
+		snapshot = None
+		if (
+			menu
+			and menu.displayText
+			and menu.displayText.startswith('** Clear All (To delete one by one, right click the item.) **')
+		):
+			snapshot = MessagesContextMenuSnapshot.fromMenu(menu)
+		self._messagesContextMenuWindows[menuWindowHandle] = (menuSignature, snapshot)
+		return snapshot
+
+	def dropMessagesContextMenuSnapshot(self, menuWindowHandle):
+		"""Forgets what is remembered for the given menu window, for example because its items changed."""
+		self._messagesContextMenuWindows.pop(menuWindowHandle, None)
+
+	def _chooseDanaEditOverlay(self, obj, clsList):
+		if obj.IAccessibleRole == oleacc.ROLE_SYSTEM_CLIENT:
 			try:
 				clsList.remove(DisplayModelEditableText)
 			except ValueError:
 				pass
 			clsList.insert(0, DanaEdit)
-			return
-		if(
-			obj.windowClassName == 'SysTreeView32'
-			and obj.role == CTWRAPPER.Role.TREEVIEWITEM
-			and obj.windowControlID == 1000
-		):
+
+	def _chooseTreeViewOverlay(self, obj, clsList):
+		if obj.windowControlID == 1000 and obj.role == CTWRAPPER.Role.TREEVIEWITEM:
 			clsList.insert(0, FolderTreeViewItem)
+
+	def _chooseMenuOverlay(self, obj, clsList):
+		if obj.role != CTWRAPPER.Role.MENUITEM:
 			return
-		if obj.windowClassName == '#32768' and obj.role == CTWRAPPER.Role.MENUITEM:
-			if (
-				obj.parent
-				and obj.parent.displayText
-				and obj.parent.displayText.startswith('** Clear All (To delete one by one, right click the item.) **')
-			):
-				clsList.insert(0, messagesContextMenu)
-				return
-		if (
-			obj.windowClassName == 'SysListView32'
-			and obj.role == CTWRAPPER.Role.LISTITEM
-			and obj.windowControlID in (59648, 59649, 59664)
-		):
+		snapshot = self.getMessagesContextMenuSnapshot(obj)
+		if snapshot is not None:
+			# Kept on the object, so that its properties do not have to verify the snapshot again.
+			obj.messagesContextMenuSnapshot = snapshot
+			clsList.insert(0, messagesContextMenu)
+
+	def _chooseListViewOverlay(self, obj, clsList):
+		if obj.windowControlID in MESSAGE_LIST_CONTROL_IDS and obj.role == CTWRAPPER.Role.LISTITEM:
 			clsList.insert(0, Message)
-			return
-		if obj.windowClassName == 'Becky2MainFrame' and obj.IAccessibleRole == oleacc.ROLE_SYSTEM_CLIENT:
+
+	def _chooseMainFrameOverlay(self, obj, clsList):
+		if obj.IAccessibleRole == oleacc.ROLE_SYSTEM_CLIENT:
 			clsList.insert(0, BeckyMainFrame)
-			return
-		if obj.windowClassName == 'Becky2ComposeFrame' and obj.IAccessibleRole == oleacc.ROLE_SYSTEM_CLIENT:
+
+	def _chooseComposeFrameOverlay(self, obj, clsList):
+		if obj.IAccessibleRole == oleacc.ROLE_SYSTEM_CLIENT:
 			clsList.insert(0, BeckyComposeFrame)
-			return
+
+	# Window class name is cheap to retrieve, so it is used to select the only check which can succeed.
+	_OVERLAY_CHOOSERS = {
+		'DanaEditWindowClass': _chooseDanaEditOverlay,
+		'SysTreeView32': _chooseTreeViewOverlay,
+		'#32768': _chooseMenuOverlay,
+		'SysListView32': _chooseListViewOverlay,
+		'Becky2MainFrame': _chooseMainFrameOverlay,
+		'Becky2ComposeFrame': _chooseComposeFrameOverlay,
+	}
+
+	@timed("chooseNVDAObjectOverlayClasses")
+	def chooseNVDAObjectOverlayClasses(self, obj, clsList):
+		chooser = self._OVERLAY_CHOOSERS.get(obj.windowClassName)
+		if chooser is not None:
+			chooser(self, obj, clsList)
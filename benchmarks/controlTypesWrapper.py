@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+
+# Benchmark of role and state lookups through the controlTypes compatibility wrapper.
+# Copyright (C) 2019-2022 Łukasz Golonka <lukasz.golonka@mailbox.org>
+# Released under GPL 2
+
+""" Compares the cost of resolving a name through `EnhancedGetter.__getattr__` on every access,
+as was done before resolved values were memoized, with reading a memoized value.
+
+Usage: python benchmarks/controlTypesWrapper.py [--lookups 1000000]
+"""
+
+import argparse
+import time
+
+import nvdaStubs
+
+
+# Names looked up on hot paths of the add-on.
+LOOKUPS = (("State", "EXPANDED"), ("State", "SELECTABLE"), ("State", "SELECTED"), ("State", "CHECKED"))
+
+
+def measure(name, lookup, count):
+	start = time.time()
+	for index in range(count // len(LOOKUPS)):
+		for kind, attrName in LOOKUPS:
+			lookup(kind, attrName)
+	elapsed = time.time() - start
+	print("{}: {:.0f} ns per lookup".format(name, elapsed / count * 1e9))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--lookups", type=int, default=1000000, help="Amount of lookups to perform")
+	args = parser.parse_args()
+	b2 = nvdaStubs.importAppModule()
+	wrapper = b2.ControlTypesCompatWrapper()
+	measure(
+		"resolved on every access",
+		lambda kind, attrName: b2.EnhancedGetter.__getattr__(getattr(wrapper, kind), attrName),
+		args.lookups
+	)
+	measure("memoized", lambda kind, attrName: getattr(getattr(wrapper, kind), attrName), args.lookups)
+
+
+if __name__ == "__main__":
+	main()
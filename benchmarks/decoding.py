@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+
+# Accuracy and throughput benchmark of message list decoding.
+# Copyright (C) 2019-2022 Łukasz Golonka <lukasz.golonka@mailbox.org>
+# Released under GPL 2
+
+""" Runs `Message._getColumnContentRaw` over a corpus of subjects and senders in various code pages,
+with column bytes and screen content simulated, and reports:
+
+- decodes per second, with all caches cleared before every item (cold) and kept (warm),
+- display model reads per item,
+- rate of items decoded to something else than the original text,
+- items decoded correctly when only the screen is used to verify code pages, as the add-on did
+before code pages were guessed from bytes alone, but not by the full decoding (regressions).
+
+Usage: python benchmarks/decoding.py [--locale-encoding cp1250] [--rounds 20]
+"""
+
+import argparse
+import time
+
+import nvdaStubs
+
+
+# Subjects and senders as they are stored in the list view, i.e. encoded using the charset of the message.
+CORPUS = (
+	("utf8", u"Zażółć gęślą jaźń"),
+	("utf8", u"Ответ: отчёт за квартал"),
+	("utf8", u"会議のお知らせ"),
+	("utf8", u"Łukasz Golonka"),
+	("cp1250", u"Spotkanie zarządu w środę"),
+	("cp1250", u"Paweł Żółkiewski"),
+	("cp1250", u"Faktura nr 12/2022 - płatność"),
+	("cp1250", u"Zažluťoučký kůň úpěl ďábelské ódy"),
+	("cp1252", u"España"),
+	("cp1252", u"Café crème"),
+	("cp1252", u"Réunion à Genève"),
+	("1251", u"Привет, как дела?"),
+	("1251", u"Отчёт за квартал"),
+	("1251", u"Иван Петров"),
+	("1251", u"Re: Заявка на участие в конференции"),
+	("1251", u"Список рассылки разработчиков"),
+	("shift_jis", u"会議のお知らせ"),
+	("shift_jis", u"こんにちは"),
+	("shift_jis", u"Re: 見積書の件について"),
+	("shift_jis", u"山田 太郎"),
+	("shift_jis", u"会議資料"),
+	("shift_jis", u"ﾃｽﾄ"),
+	("gb18030", u"关于会议的通知"),
+	("gb18030", u"你好世界"),
+	("gb18030", u"回复: 订单问题"),
+	("gb18030", u"张伟"),
+	("gb18030", u"谢谢"),
+	("gb18030", u"通知"),
+	("gb18030", u"发票"),
+	("cp949", u"안녕하세요 회의 안내"),
+	("cp949", u"첨부 파일 확인"),
+	("cp949", u"김민수"),
+	("cp949", u"답변: 결과 보고"),
+	("cp949", u"테스트"),
+)
+
+# Amount of characters which fit in the simulated column.
+COLUMN_WIDTH = 12
+
+
+def simulateScreenContent(text):
+	"""Returns text drawn on the screen for a column, truncated with an ellipsis if it does not fit."""
+	if len(text) <= COLUMN_WIDTH:
+		return text
+	return text[:COLUMN_WIDTH - 3] + "..."
+
+
+def makeMessageClass(b2, localeEncoding, stats):
+
+	class BenchDisplayModelTextInfo(object):
+
+		def __init__(self, obj, rect):
+			stats["displayModelReads"] += 1
+			self.text = obj.screenContent
+
+	b2.DisplayModelTextInfo = BenchDisplayModelTextInfo
+
+	class BenchMessage(b2.Message):
+
+		POSSIBLE_ENCODINGS = ("utf8", localeEncoding, "1251", "shift_jis", "gb18030", "cp949")
+		appModule = type("BenchAppModule", (object,), {"currentFolderName": "Inbox"})()
+		windowHandle = 1
+
+		def __init__(self, itemIndex, data, screenContent):
+			self.IAccessibleChildID = itemIndex + 1
+			self.data = data
+			self.screenContent = screenContent
+
+		def _get_rowColumnsBytes(self):
+			return {0: self.data}
+
+		def _getColumnLocationRaw(self, index):
+			return (0, 0, 100, 10)
+
+	return BenchMessage
+
+
+def clearCaches(b2):
+	b2.decodedColumnsCache.clear()
+	b2.rowEncodingMemo.clear()
+	b2.encodingStatistics.clear()
+
+
+def run(localeEncoding, rounds):
+	b2 = nvdaStubs.importAppModule()
+	stats = {"displayModelReads": 0}
+	BenchMessage = makeMessageClass(b2, localeEncoding, stats)
+	items = [
+		BenchMessage(index, text.encode(encoding), simulateScreenContent(text))
+		for index, (encoding, text) in enumerate(CORPUS)
+	]
+	screenOnlyMisDecoded = set()
+	for item, (encoding, text) in zip(items, CORPUS):
+		clearCaches(b2)
+		if item._getDecodedColContentFromDisplayModel(item.data, 0) != text:
+			screenOnlyMisDecoded.add((encoding, text))
+	for mode in ("cold", "warm"):
+		clearCaches(b2)
+		stats["displayModelReads"] = 0
+		misDecoded = set()
+		start = time.time()
+		for roundNo in range(rounds):
+			for item, (encoding, text) in zip(items, CORPUS):
+				if mode == "cold":
+					clearCaches(b2)
+				if item._getColumnContentRaw(0) != text:
+					misDecoded.add((encoding, text))
+		elapsed = time.time() - start
+		decodes = rounds * len(items)
+		print("{}: {:.0f} decodes/s, {:.2f} display model reads per item, mis-decode rate {:.1%}".format(
+			mode,
+			decodes / elapsed,
+			stats["displayModelReads"] / float(decodes),
+			len(misDecoded) / float(len(items))
+		))
+		for encoding, text in sorted(misDecoded):
+			print(u"  mis-decoded {}{}: {}".format(
+				encoding,
+				"" if (encoding, text) in screenOnlyMisDecoded else " (regression)",
+				text
+			))
+	print("screen only: mis-decode rate {:.1%}".format(len(screenOnlyMisDecoded) / float(len(items))))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument(
+		"--locale-encoding",
+		default="cp1250",
+		help="Code page for non-Unicode programs of the simulated system"
+	)
+	parser.add_argument("--rounds", type=int, default=20, help="How many times the corpus is decoded")
+	args = parser.parse_args()
+	run(args.locale_encoding, args.rounds)
+
+
+if __name__ == "__main__":
+	main()
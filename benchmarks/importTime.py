@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+
+# Cold load time of the Becky! app module.
+# Copyright (C) 2019-2022 Łukasz Golonka <lukasz.golonka@mailbox.org>
+# Released under GPL 2
+
+""" Imports the app module in fresh interpreters, with NVDA modules replaced by stand-ins,
+and reports how long executing the add-on's own code takes,
+modules loaded by it which NVDA has not loaded at that point,
+and NVDA modules which the add-on needs before any of its code runs.
+
+Usage: python benchmarks/importTime.py [--runs 20]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+MEASURE_CODE = """
+import builtins, json, sys, time
+sys.dont_write_bytecode = False
+sys.pycache_prefix = {cacheDir!r}
+sys.path.insert(0, {benchmarksDir!r})
+import nvdaStubs
+nvdaStubs.install()
+modulesBefore = set(sys.modules)
+requested = set()
+originalImport = builtins.__import__
+def recordingImport(name, *args, **kwargs):
+	requested.add(name)
+	return originalImport(name, *args, **kwargs)
+builtins.__import__ = recordingImport
+start = time.time()
+import b2
+elapsed = time.time() - start
+builtins.__import__ = originalImport
+print(json.dumps({{
+	"elapsed": elapsed,
+	"modules": sorted(set(sys.modules) - modulesBefore - {{"b2"}}),
+	"nvdaModules": sorted(name for name in requested - {{"b2"}} if name in nvdaStubs.STUBBED_MODULES),
+}}))
+"""
+
+
+def measureOnce(cacheDir):
+	code = MEASURE_CODE.format(benchmarksDir=os.path.dirname(os.path.abspath(__file__)), cacheDir=cacheDir)
+	output = subprocess.check_output([sys.executable, "-c", code])
+	return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--runs", type=int, default=20, help="Amount of fresh interpreters to measure")
+	args = parser.parse_args()
+	cacheDir = tempfile.mkdtemp()
+	try:
+		# The first import compiles the module, NVDA normally loads it from the cached bytecode.
+		compiling = measureOnce(cacheDir)
+		results = [measureOnce(cacheDir) for run in range(args.runs)]
+	finally:
+		shutil.rmtree(cacheDir)
+	print("load of b2 including compilation: {:.2f} ms".format(compiling["elapsed"] * 1000))
+	times = sorted(result["elapsed"] for result in results)
+	print("cold load of b2: median {:.2f} ms, best {:.2f} ms over {} runs".format(
+		times[len(times) // 2] * 1000,
+		times[0] * 1000,
+		len(times)
+	))
+	print("modules loaded by the add-on: {}".format(", ".join(results[-1]["modules"]) or "none"))
+	print("NVDA modules needed at load: {}".format(", ".join(results[-1]["nvdaModules"])))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,219 @@
+# -*- coding: UTF-8 -*-
+
+# Minimal stand-ins for NVDA modules, allowing the Becky! app module to be imported outside of NVDA.
+# Copyright (C) 2019-2022 Łukasz Golonka <lukasz.golonka@mailbox.org>
+# Released under GPL 2
+
+""" Only what is needed to import `b2` and to run its pure Python parts is provided.
+Anything talking to Windows or to Becky! has to be replaced by the benchmark itself.
+"""
+
+import collections
+import ctypes
+import os
+import sys
+import types
+
+
+APP_MODULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "addon", "appModules")
+
+
+class AutoPropertyObject(object):
+	"""Resolves `obj.x` to `obj._get_x()` like NVDA's base object does, without any caching."""
+
+	def __getattr__(self, attrName):
+		getter = getattr(type(self), "_get_" + attrName, None)
+		if getter is None:
+			raise AttributeError(attrName)
+		return getter(self)
+
+
+class LVITEM(ctypes.Structure):
+	_fields_ = [
+		("mask", ctypes.c_uint),
+		("iItem", ctypes.c_int),
+		("iSubItem", ctypes.c_int),
+		("state", ctypes.c_uint),
+		("stateMask", ctypes.c_uint),
+		("pszText", ctypes.c_void_p),
+		("cchTextMax", ctypes.c_int),
+		("iImage", ctypes.c_int),
+		("lParam", ctypes.c_void_p),
+		("iIndent", ctypes.c_int),
+		("iGroupId", ctypes.c_int),
+		("cColumns", ctypes.c_uint),
+		("puColumns", ctypes.c_void_p),
+		("piColFmt", ctypes.c_void_p),
+		("iGroup", ctypes.c_int),
+	]
+
+
+class FieldCommand(object):
+
+	def __init__(self, command, field):
+		self.command = command
+		self.field = field
+
+
+class DisplayModelTextInfo(object):
+	"""Replaced by benchmarks which need screen content."""
+
+	def __init__(self, obj, position):
+		self.obj = obj
+		self.position = position
+		self.text = u""
+
+
+def _names(*names):
+	return type("Names", (object,), dict((name, name.lower()) for name in names))
+
+
+# Names of all modules replaced by stand-ins.
+STUBBED_MODULES = set()
+
+
+def _makeModule(name, **attrs):
+	mod = types.ModuleType(name)
+	mod.__dict__.update(attrs)
+	sys.modules[name] = mod
+	STUBBED_MODULES.add(name)
+	return mod
+
+
+def _noop(*args, **kwargs):
+	return None
+
+
+def install():
+	"""Registers stand-in modules and makes the app modules directory importable."""
+	if "appModuleHandler" in sys.modules:
+		return
+	try:
+		import six  # NOQA: F401
+	except ImportError:
+		_makeModule("six", string_types=(str,))
+	_makeModule(
+		"api",
+		getForegroundObject=_noop,
+		getFocusObject=_noop,
+		getReviewPosition=_noop,
+		setReviewPosition=_noop,
+	)
+	_makeModule(
+		"appModuleHandler",
+		AppModule=type("AppModule", (AutoPropertyObject,), {
+			"__init__": lambda self, *args, **kwargs: setattr(self, "processHandle", 1),
+			"terminate": _noop,
+		})
+	)
+	_makeModule("colors", RGB=collections.namedtuple("RGB", ("red", "green", "blue")))
+	_makeModule(
+		"controlTypes",
+		Role=_names("EDITABLETEXT", "TREEVIEW", "TREEVIEWITEM", "MENUITEM", "LISTITEM", "LIST", "STATUSBAR"),
+		State=_names("INVISIBLE", "EXPANDED", "COLLAPSED", "SELECTABLE", "SELECTED", "CHECKED", "FOCUSED"),
+	)
+	_makeModule("core", callLater=_noop)
+	_makeModule(
+		"displayModel",
+		DisplayModelTextInfo=DisplayModelTextInfo,
+		EditableTextDisplayModelTextInfo=type("EditableTextDisplayModelTextInfo", (DisplayModelTextInfo,), {}),
+		getCaretRect=_noop,
+	)
+	_makeModule("gui", mainFrame=None)
+	_makeModule(
+		"locationHelper",
+		RectLTRB=collections.namedtuple("RectLTRB", ("left", "top", "right", "bottom")),
+	)
+	_makeModule("logHandler", log=type("Log", (object,), {
+		"debug": _noop, "debugWarning": _noop, "info": _noop, "error": _noop, "exception": _noop,
+		"isEnabledFor": lambda self, level: False,
+	})())
+	_makeModule("mouseHandler", executeMouseEvent=_noop)
+	_makeModule("oleacc", ROLE_SYSTEM_CLIENT=10, ROLE_SYSTEM_STATUSBAR=23, STATE_SYSTEM_CHECKED=0x10)
+	_makeModule("scriptHandler", script=lambda **kwargs: (lambda func: func))
+	textInfos = _makeModule(
+		"textInfos",
+		FieldCommand=FieldCommand,
+		UNIT_CHARACTER="character",
+		UNIT_LINE="line",
+		UNIT_PARAGRAPH="paragraph",
+		POSITION_ALL="all",
+		POSITION_CARET="caret",
+		POSITION_FIRST="first",
+		POSITION_SELECTION="selection",
+	)
+	textInfos.offsets = _makeModule(
+		"textInfos.offsets",
+		Offsets=collections.namedtuple("Offsets", ("startOffset", "endOffset")),
+	)
+	_makeModule("ui", message=_noop)
+	_makeModule("watchdog", cancellableSendMessage=_noop)
+	_makeModule(
+		"windowUtils",
+		findDescendantWindow=_noop,
+		# Display scaling of 100%.
+		logicalToPhysicalPoint=lambda windowHandle, x, y: (x, y),
+	)
+	_makeModule(
+		"winUser",
+		OBJID_CLIENT=-4,
+		getCursorPos=lambda: (0, 0),
+		setCursorPos=_noop,
+		isWindow=lambda hwnd: True,
+		isWindowVisible=lambda hwnd: True,
+		getAncestor=lambda hwnd, flags: hwnd,
+		GA_ROOT=2,
+		sendMessage=_noop,
+		MOUSEEVENTF_LEFTDOWN=2,
+		MOUSEEVENTF_LEFTUP=4,
+		MOUSEEVENTF_RIGHTDOWN=8,
+		MOUSEEVENTF_RIGHTUP=16,
+	)
+	_makeModule(
+		"winKernel",
+		MEM_COMMIT=0x1000,
+		MEM_RELEASE=0x8000,
+		PAGE_READWRITE=4,
+		virtualAllocEx=_noop,
+		virtualFreeEx=_noop,
+		writeProcessMemory=_noop,
+		readProcessMemory=_noop,
+	)
+	_makeModule("wx", CallAfter=_noop)
+	nvdaObjects = _makeModule("NVDAObjects", NVDAObject=type("NVDAObject", (AutoPropertyObject,), {}))
+	nvdaObjects.behaviors = _makeModule(
+		"NVDAObjects.behaviors",
+		EditableTextWithoutAutoSelectDetection=type("EditableTextWithoutAutoSelectDetection", (object,), {}),
+	)
+	nvdaObjects.window = _makeModule(
+		"NVDAObjects.window",
+		Window=type("Window", (nvdaObjects.NVDAObject,), {}),
+		DisplayModelEditableText=type("DisplayModelEditableText", (object,), {}),
+	)
+	iAccessible = type("IAccessible", (nvdaObjects.NVDAObject,), {})
+	nvdaObjects.IAccessible = _makeModule(
+		"NVDAObjects.IAccessible",
+		IAccessible=iAccessible,
+		MenuItem=type("MenuItem", (iAccessible,), {}),
+		getNVDAObjectFromEvent=_noop,
+	)
+	nvdaObjects.IAccessible.sysListView32 = _makeModule(
+		"NVDAObjects.IAccessible.sysListView32",
+		ListItem=type("ListItem", (iAccessible,), {"LVITEM": LVITEM}),
+		CBEMAXSTRLEN=260,
+		LVIF_TEXT=0x1,
+		LVIF_COLUMNS=0x200,
+	)
+	nvdaObjects.IAccessible.sysTreeView32 = _makeModule(
+		"NVDAObjects.IAccessible.sysTreeView32",
+		TreeViewItem=type("TreeViewItem", (iAccessible,), {}),
+	)
+	if APP_MODULES_DIR not in sys.path:
+		sys.path.insert(0, APP_MODULES_DIR)
+
+
+def importAppModule():
+	"""Installs stand-ins and returns imported Becky! app module."""
+	install()
+	import b2
+	return b2
@@ -0,0 +1,159 @@
+# -*- coding: UTF-8 -*-
+
+# Micro-benchmark of overlay class selection.
+# Copyright (C) 2019-2022 Łukasz Golonka <lukasz.golonka@mailbox.org>
+# Released under GPL 2
+
+""" Feeds `AppModule.chooseNVDAObjectOverlayClasses` with stubbed objects resembling
+what NVDA creates while navigating Becky!, and reports time per object
+together with the amount of reads of properties which in NVDA need a cross-process call.
+The sequential checks used before the dispatch table are measured as well for comparison.
+
+Usage: python benchmarks/overlayClasses.py [--objects 100000]
+"""
+
+import argparse
+import collections
+import time
+
+import nvdaStubs
+
+
+# Properties which NVDA retrieves from Becky! or from the display model.
+EXPENSIVE_PROPERTIES = ("role", "IAccessibleRole", "parent", "displayText")
+
+CONTEXT_MENU_TEXT = u"** Clear All (To delete one by one, right click the item.) **"
+
+
+class StubObject(object):
+
+	reads = collections.Counter()
+
+	def __init__(self, windowClassName, windowHandle, role, IAccessibleRole, windowControlID=0, parent=None):
+		self.windowClassName = windowClassName
+		self.windowHandle = windowHandle
+		self.windowControlID = windowControlID
+		self._values = {"role": role, "IAccessibleRole": IAccessibleRole, "parent": parent, "displayText": None}
+
+	def __getattr__(self, attrName):
+		if attrName in EXPENSIVE_PROPERTIES:
+			StubObject.reads[attrName] += 1
+			return self._values[attrName]
+		raise AttributeError(attrName)
+
+
+class StubMenuAccessible(object):
+	"""IAccessible of a menu, each call of its methods is a cross-process call in NVDA."""
+
+	def __init__(self, childCount, firstItemName):
+		self._childCount = childCount
+		self._firstItemName = firstItemName
+
+	@property
+	def accChildCount(self):
+		StubObject.reads["accChildCount"] += 1
+		return self._childCount
+
+	def accName(self, childID):
+		StubObject.reads["accName"] += 1
+		if childID == 1:
+			return self._firstItemName
+		return u"{}: message {}".format(childID % 10, childID)
+
+	def accKeyboardShortcut(self, childID):
+		StubObject.reads["accKeyboardShortcut"] += 1
+		return str(childID % 10)
+
+	def accState(self, childID):
+		StubObject.reads["accState"] += 1
+		return 0x10 if childID % 2 else 0
+
+
+def makeMenuItem(menu):
+	"""Items of menus are simple children, sharing the IAccessible of their menu."""
+	menuItem = StubObject("#32768", menu.windowHandle, menu._values["role"], 12, parent=menu)
+	menuItem.IAccessibleObject = menu.IAccessibleObject
+	return menuItem
+
+
+def makeObjects(b2, count):
+	Role = b2.CTWRAPPER.Role
+	menu = StubObject("#32768", 30, Role.MENUITEM, 12)
+	menu._values["displayText"] = CONTEXT_MENU_TEXT
+	menu.IAccessibleObject = StubMenuAccessible(20, CONTEXT_MENU_TEXT)
+	otherMenu = StubObject("#32768", 31, Role.MENUITEM, 12)
+	otherMenu._values["displayText"] = u"&Reply"
+	otherMenu.IAccessibleObject = StubMenuAccessible(6, u"Reply")
+	templates = (
+		lambda i: StubObject("SysListView32", 10, Role.LISTITEM, 34, windowControlID=59648),
+		lambda i: StubObject("SysListView32", 10, Role.LISTITEM, 34, windowControlID=59648),
+		lambda i: StubObject("SysTreeView32", 20, Role.TREEVIEWITEM, 36, windowControlID=1000),
+		lambda i: makeMenuItem(menu),
+		lambda i: makeMenuItem(otherMenu),
+		lambda i: StubObject("DanaEditWindowClass", 40, Role.EDITABLETEXT, 10),
+		lambda i: StubObject("Button", 50, None, 43),
+		lambda i: StubObject("Edit", 60, None, 42),
+	)
+	return [templates[index % len(templates)](index) for index in range(count)]
+
+
+def chooseSequentially(b2, obj, clsList):
+	""" Overlay class selection as it was done before the dispatch table was introduced. """
+	Role = b2.CTWRAPPER.Role
+	if obj.windowClassName == 'DanaEditWindowClass' and obj.IAccessibleRole == b2.oleacc.ROLE_SYSTEM_CLIENT:
+		clsList.insert(0, b2.DanaEdit)
+		return
+	if obj.windowClassName == 'SysTreeView32' and obj.role == Role.TREEVIEWITEM and obj.windowControlID == 1000:
+		clsList.insert(0, b2.FolderTreeViewItem)
+		return
+	if obj.windowClassName == '#32768' and obj.role == Role.MENUITEM:
+		if obj.parent and obj.parent.displayText and obj.parent.displayText.startswith(CONTEXT_MENU_TEXT):
+			clsList.insert(0, b2.messagesContextMenu)
+			return
+	if obj.windowClassName == 'SysListView32' and obj.role == Role.LISTITEM and obj.windowControlID in (
+		59648, 59649, 59664
+	):
+		clsList.insert(0, b2.Message)
+		return
+	if obj.windowClassName == 'Becky2MainFrame' and obj.IAccessibleRole == b2.oleacc.ROLE_SYSTEM_CLIENT:
+		clsList.insert(0, b2.BeckyMainFrame)
+		return
+	if obj.windowClassName == 'Becky2ComposeFrame' and obj.IAccessibleRole == b2.oleacc.ROLE_SYSTEM_CLIENT:
+		clsList.insert(0, b2.BeckyComposeFrame)
+		return
+
+
+def measure(name, choose, objects):
+	StubObject.reads.clear()
+	chosen = collections.Counter()
+	start = time.time()
+	for obj in objects:
+		clsList = []
+		choose(obj, clsList)
+		if clsList:
+			chosen[clsList[0].__name__] += 1
+	elapsed = time.time() - start
+	print("{}: {:.0f} ns per object, {:.2f} expensive reads per object ({})".format(
+		name,
+		elapsed / len(objects) * 1e9,
+		sum(StubObject.reads.values()) / float(len(objects)),
+		", ".join("{} {}".format(attrName, count) for attrName, count in sorted(StubObject.reads.items()))
+	))
+	return chosen
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--objects", type=int, default=100000, help="Amount of objects to classify")
+	args = parser.parse_args()
+	b2 = nvdaStubs.importAppModule()
+	appModule = b2.AppModule()
+	objects = makeObjects(b2, args.objects)
+	sequential = measure("sequential checks", lambda obj, clsList: chooseSequentially(b2, obj, clsList), objects)
+	dispatched = measure("dispatch table", appModule.chooseNVDAObjectOverlayClasses, objects)
+	if sequential != dispatched:
+		print("Chosen classes differ: {} != {}".format(sequential, dispatched))
+
+
+if __name__ == "__main__":
+	main()
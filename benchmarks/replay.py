@@ -0,0 +1,381 @@
+# -*- coding: UTF-8 -*-
+
+# Replays sessions recorded in Becky! as deterministic performance regression tests.
+# Copyright (C) 2019-2022 Łukasz Golonka <lukasz.golonka@mailbox.org>
+# Released under GPL 2
+
+""" Feeds a session recorded with NVDA+Control+Shift+E back through the app module.
+
+Content of list view cells is served by stand-ins of the kernel functions and of the message sender
+used by `RemoteBufferPool`, text and lines of the display model by a stand-in of `DisplayModelTextInfo`,
+and the first visible item of the folder tree by a stand-in of `watchdog.cancellableSendMessage`.
+Events are dispatched to the app module in the recorded order,
+fired by objects of the overlay classes they had in NVDA,
+and every recorded call of a hot path is repeated and its result compared with the recorded one.
+Clock of the app module follows times of the entries, so that its caches expire as they did during recording.
+Timings of the hot paths are reported as percentiles, like in the add-on itself.
+Exits with status 1 if any result differs from the recording.
+
+Usage: python benchmarks/replay.py beckySession.jsonl.gz [--rounds 5]
+"""
+
+import argparse
+import base64
+import collections
+import ctypes
+import functools
+import gzip
+import heapq
+import json
+import sys
+import time
+
+import nvdaStubs
+
+
+RectLTWH = collections.namedtuple("RectLTWH", ("left", "top", "width", "height"))
+
+
+def loadRecording(path):
+	with gzip.open(path, "rb") as recording:
+		return [json.loads(line.decode("utf8")) for line in recording if line.strip()]
+
+
+class SessionState(object):
+	"""What Becky! exposed at the current point of the recording."""
+
+	def __init__(self):
+		self.listCells = {}
+		self.screens = {}
+		self.screenLines = {}
+		self.firstVisibleTreeItems = {}
+		self.focusObject = None
+		self.missingReads = collections.Counter()
+
+	def apply(self, entry):
+		if entry["t"] == "listCells":
+			for itemIndex, subItem, data in entry["cells"]:
+				self.listCells[(entry["hwnd"], itemIndex, subItem)] = (
+					None if data is None else base64.b64decode(data)
+				)
+		elif entry["t"] == "screen":
+			self.screens[(entry["hwnd"], tuple(entry["rect"]))] = entry["text"]
+		elif entry["t"] == "screenLines":
+			self.screenLines[(entry["hwnd"], tuple(entry["rect"]))] = entry["lines"]
+		elif entry["t"] == "firstVisibleTreeItem":
+			self.firstVisibleTreeItems[entry["hwnd"]] = entry["item"]
+
+
+class ReplayClock(object):
+	"""Time of the recording, firing callbacks scheduled with `core.callLater` once it passes their deadline."""
+
+	def __init__(self):
+		self.now = 0
+		self._timers = []
+		self._timersCount = 0
+
+	def __call__(self):
+		return self.now
+
+	def callLater(self, delay, callable, *args, **kwargs):
+		self._timersCount += 1
+		heapq.heappush(
+			self._timers,
+			(self.now + delay / 1000.0, self._timersCount, functools.partial(callable, *args, **kwargs))
+		)
+
+	def advance(self, now):
+		while self._timers and self._timers[0][0] <= now:
+			deadline, timerNo, func = heapq.heappop(self._timers)
+			self.now = max(self.now, deadline)
+			func()
+		self.now = max(self.now, now)
+
+
+class ReplayKernel(object):
+	"""Remote memory of Becky!, simulated in this process."""
+
+	MEM_COMMIT = 0x1000
+	PAGE_READWRITE = 0x4
+	MEM_RELEASE = 0x8000
+
+	def __init__(self):
+		self._regions = {}
+		self._nextAddress = 0x10000
+
+	def virtualAllocEx(self, processHandle, address, size, allocationType, protect):
+		address = self._nextAddress
+		self._nextAddress += (size // 0x10000 + 1) * 0x10000
+		self._regions[address] = ctypes.create_string_buffer(size)
+		return address
+
+	def virtualFreeEx(self, processHandle, address, size, freeType):
+		del self._regions[address]
+
+	def locate(self, address):
+		for start, region in self._regions.items():
+			if start <= address < start + len(region):
+				return region, address - start
+		raise ValueError("Address {:#x} has not been allocated".format(address))
+
+	def writeProcessMemory(self, processHandle, address, buffer, size, bytesWritten):
+		region, offset = self.locate(address)
+		ctypes.memmove(ctypes.addressof(region) + offset, buffer, size)
+
+	def readProcessMemory(self, processHandle, address, buffer, size, bytesRead):
+		region, offset = self.locate(address)
+		ctypes.memmove(buffer, ctypes.addressof(region) + offset, size)
+
+
+def makeSendMessage(b2, kernel, state):
+	"""Answers `LVM_GETITEMTEXTA` with recorded content of cells, as Becky!'s list view would."""
+	LVITEM = nvdaStubs.LVITEM
+
+	def sendMessage(windowHandle, message, wParam, lParam):
+		if message != b2.LVM_GETITEMTEXTA:
+			return 0
+		region, offset = kernel.locate(lParam)
+		item = LVITEM.from_buffer_copy(region.raw[offset:offset + ctypes.sizeof(LVITEM)])
+		key = (windowHandle, wParam, item.iSubItem)
+		if key not in state.listCells:
+			state.missingReads["list cell"] += 1
+		data = state.listCells.get(key) or b""
+		data = data[:item.cchTextMax - 1]
+		textRegion, textOffset = kernel.locate(item.pszText)
+		ctypes.memmove(ctypes.addressof(textRegion) + textOffset, data + b"\0", len(data) + 1)
+		return len(data)
+
+	return sendMessage
+
+
+def installScreenStandIns(b2, state):
+	"""Makes the app module read the display model and the folder tree from the recording."""
+
+	class ReplayDisplayModelTextInfo(object):
+
+		def __init__(self, obj, rect):
+			self._key = (obj.windowHandle, (rect.left, rect.top, rect.right, rect.bottom))
+
+		@property
+		def text(self):
+			if self._key not in state.screens:
+				state.missingReads["screen"] += 1
+			return state.screens.get(self._key, u"")
+
+		@property
+		def _storyFieldsAndRects(self):
+			"""Lines are drawn one below another, every character covering the whole height of its line."""
+			if self._key not in state.screenLines:
+				state.missingReads["screen lines"] += 1
+			fields = []
+			rects = []
+			for top, bottom, text in state.screenLines.get(self._key, ()):
+				fields.append(text + u"\n")
+				rects.extend([b2.makeRect(0, top, 0, bottom)] * (len(text) + 1))
+			return fields, rects
+
+	b2.DisplayModelTextInfo = ReplayDisplayModelTextInfo
+
+	def cancellableSendMessage(windowHandle, message, wParam, lParam):
+		if message == b2.TVM_GETNEXTITEM and wParam == b2.TVGN_FIRSTVISIBLE:
+			if windowHandle not in state.firstVisibleTreeItems:
+				state.missingReads["first visible tree item"] += 1
+			return state.firstVisibleTreeItems.get(windowHandle, 0)
+		return 0
+
+	b2.watchdog.cancellableSendMessage = cancellableSendMessage
+
+
+def makeReplayClasses(b2, state, localeEncoding):
+
+	class ReplayMessage(b2.Message):
+
+		POSSIBLE_ENCODINGS = ("utf8", localeEncoding, "1251", "shift_jis", "gb18030", "cp949")
+
+		def __init__(self, appModule, entry):
+			self.appModule = appModule
+			self.windowHandle = entry["hwnd"]
+			self.IAccessibleChildID = entry["childID"]
+			self.columnCount = entry["columnCount"]
+			self.columnLocation = entry["location"]
+			self._rowColumnsBytes = None
+
+		def _get_rowColumnsBytes(self):
+			# Read synchronously, so that the order of reads does not depend on worker threads.
+			# Kept for the life of the object, as NVDA caches it.
+			if self._rowColumnsBytes is None:
+				self._rowColumnsBytes = self._getColumnsBytes(range(self.columnCount))
+			return self._rowColumnsBytes
+
+		def _getColumnLocationRaw(self, index):
+			return RectLTWH(*self.columnLocation)
+
+	class ReplayFolderTreeViewItem(b2.FolderTreeViewItem):
+
+		def __init__(self, appModule, entry):
+			self.appModule = appModule
+			self.windowHandle = entry["hwnd"]
+			self.name = entry["name"]
+			self.location = RectLTWH(*entry["location"])
+			self.treeView = type("ReplayTreeView", (object,), {
+				"windowHandle": entry["hwnd"],
+				"location": RectLTWH(*entry["treeLocation"]),
+			})()
+
+	class ReplayStatusBarReader(b2.StatusBarReader):
+
+		def __init__(self, entry):
+			super(ReplayStatusBarReader, self).__init__(entry["hwnd"])
+			self.entry = entry
+
+		def _getStatusBarHandle(self):
+			return self.entry["statusBar"]
+
+		def _getUnreadInfo(self, statusBarHandle):
+			return self.entry["text"]
+
+	return ReplayMessage, ReplayFolderTreeViewItem, ReplayStatusBarReader
+
+
+class ReplayObject(object):
+	"""Object which fired a recorded event."""
+
+	def __init__(self, entry):
+		self.windowClassName = entry["windowClassName"]
+		self.windowControlID = entry["controlID"]
+		self.windowHandle = entry["hwnd"]
+		self.IAccessibleChildID = entry["childID"]
+		self.name = entry["objName"]
+
+	def __eq__(self, other):
+		return (
+			isinstance(other, ReplayObject)
+			and (self.windowHandle, self.IAccessibleChildID) == (other.windowHandle, other.IAccessibleChildID)
+		)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash((self.windowHandle, self.IAccessibleChildID))
+
+
+def makeEventObject(b2, entry, eventClasses):
+	"""Creates object which fired a recorded event, with the overlay class it had in NVDA."""
+	overlayClass = entry["overlayClass"]
+	if overlayClass is None:
+		return ReplayObject(entry)
+	try:
+		cls = eventClasses[overlayClass]
+	except KeyError:
+		cls = eventClasses[overlayClass] = type(
+			"Replay" + overlayClass,
+			(ReplayObject, getattr(b2, overlayClass)),
+			{}
+		)
+	return cls(entry)
+
+
+def clearCaches(b2):
+	b2.decodedColumnsCache.clear()
+	b2.rowEncodingMemo.clear()
+	b2.encodingStatistics.clear()
+
+
+def replay(b2, entries, localeEncoding):
+	"""Replays all entries once with cold caches, returning list of results which differ from the recording."""
+	import api
+	import core
+	clearCaches(b2)
+	state = SessionState()
+	clock = ReplayClock()
+	core.callLater = clock.callLater
+	api.getFocusObject = lambda: state.focusObject
+	kernel = ReplayKernel()
+	installScreenStandIns(b2, state)
+	ReplayMessage, ReplayFolderTreeViewItem, ReplayStatusBarReader = makeReplayClasses(b2, state, localeEncoding)
+	appModule = b2.AppModule()
+	appModule.clock = clock
+	appModule._remoteBufferPool = b2.RemoteBufferPool(
+		appModule.processHandle,
+		kernel=kernel,
+		sendMessage=makeSendMessage(b2, kernel, state)
+	)
+	eventClasses = {}
+	mismatches = []
+	for entry in entries:
+		clock.advance(entry["time"])
+		kind = entry["t"]
+		if kind == "event":
+			obj = makeEventObject(b2, entry, eventClasses)
+			if entry["name"] == "gainFocus":
+				state.focusObject = obj
+			getattr(appModule, "event_" + entry["name"])(obj, lambda: None)
+			continue
+		if kind == "column":
+			appModule.currentFolderName = entry["folder"]
+			result = ReplayMessage(appModule, entry)._getColumnContentRaw(entry["index"])
+		elif kind == "unreadInfo":
+			result = ReplayFolderTreeViewItem(appModule, entry)._get_unreadInfo()
+		elif kind == "unreadTotal":
+			result = list(b2.getUnreadTotalCount(ReplayStatusBarReader(entry)))
+		else:
+			state.apply(entry)
+			if kind == "screenLines":
+				# The folder tree has been read again during recording, so its snapshot was outdated at this point.
+				appModule._folderTreeSnapshots.pop(entry["hwnd"], None)
+			continue
+		if result != entry["result"]:
+			mismatches.append((entry, result))
+	appModule.terminate()
+	return mismatches, state.missingReads
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("recording", help="Path of a session recorded in Becky!")
+	parser.add_argument("--rounds", type=int, default=5, help="How many times the session is replayed")
+	args = parser.parse_args()
+	b2 = nvdaStubs.importAppModule()
+	entries = loadRecording(args.recording)
+	header = entries[0] if entries and entries[0]["t"] == "header" else {}
+	if header.get("version") != b2.SessionRecorder.FORMAT_VERSION:
+		print("Unsupported recording version {}".format(header.get("version")))
+		return 2
+	kinds = collections.Counter(entry["t"] for entry in entries)
+	print("{}: {}".format(
+		args.recording,
+		", ".join("{} {}".format(kind, count) for kind, count in sorted(kinds.items()))
+	))
+	b2.timingStatistics.clear()
+	b2.timingStatistics.enabled = True
+	roundTimes = []
+	for roundNo in range(args.rounds):
+		start = time.time()
+		mismatches, missingReads = replay(b2, entries, header["localeEncoding"])
+		roundTimes.append(time.time() - start)
+	b2.timingStatistics.enabled = False
+	print("replay: median {:.1f} ms, best {:.1f} ms over {} rounds".format(
+		sorted(roundTimes)[len(roundTimes) // 2] * 1000,
+		min(roundTimes) * 1000,
+		len(roundTimes)
+	))
+	for path, callsCount, median, p90, p99, maximum in b2.timingStatistics.summary():
+		print("  {}: {} calls, median {:.3f} ms, 90th {:.3f} ms, 99th {:.3f} ms, max {:.3f} ms".format(
+			path, callsCount, median * 1000, p90 * 1000, p99 * 1000, maximum * 1000
+		))
+	for what, count in sorted(missingReads.items()):
+		print("{} reads of {} missing in the recording".format(count, what))
+	if mismatches:
+		print("{} results differ from the recording:".format(len(mismatches)))
+		for entry, result in mismatches[:10]:
+			print(u"  {} {!r}: recorded {!r}, replayed {!r}".format(
+				entry["t"], entry.get("name", entry.get("childID")), entry["result"], result
+			))
+		return 1
+	print("all results match the recording")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())